@@ -1,18 +1,56 @@
+import os
 import sys
 import re
+import mmap
+import codecs
+import binascii
+import bisect
+import functools
+from array import array
+from collections.abc import Mapping
+
+
+def profiled(name):
+    # time the method as phase `name` when a profiler is attached, otherwise just call it
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            if profiler is None:
+                return method(self, *args, **kwargs)
+            with profiler.phase(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
 
 
 class Assembler:
     def __init__(self):
+        self.__reset()
+        self.__parser = None
+        self.__profiler = None
+        self.__OPERATORS = self.OperationTable(self.__DEFAULT_OPERATORS)
+
+    def __reset(self):
         self.__source = []
-        self.__Symbols = {}
-        self.__Literals = {}
+        self.__relaxation = None
+        self.__reset_layout()
+
+    def __reset_layout(self):
+        # everything pass one and two derive from the source
         self.__begin_loc = None
+        self.__end_loc = None
         self.__title = None
         self.__base = None
         self.__program = self.Record()
-        self.__block_name = []
-        self.__block_loc = {}
+        self.__block_name = []          # program block names, the block id is the index
+        self.__block_base = []          # block id -> start address, known at the end of pass one
+        self.__block_id = {}
+        self.__Symbols = self.SymbolTable(self.__block_base)
+        self.__Literals = self.SymbolTable(self.__block_base)
+        self.__pools = {}
+        self.__exports = []             # EXTDEF symbols, in order
+        self.__externals = {}           # EXTREF symbols, in order
 
     __REGISTERS = {
         'A': 0, 'X': 1, 'L': 2, 'PC': 8, 'SW': 9,
@@ -25,30 +63,32 @@ class Assembler:
         "USE", "EXTDEF", "EXTREF", "CSECT"
     ]
 
-    __OPERATORS = {
-        "CLEAR":    {'opcode': '0xb4', 'format': 2},
-        "COMP":     {'opcode': '0x28', 'format': 3},
-        "COMPR":    {'opcode': '0xa0', 'format': 2},
-        "J":        {'opcode': '0x3c', 'format': 3},
-        "JEQ":      {'opcode': '0x30', 'format': 3},
-        "JLT":      {'opcode': '0x38', 'format': 3},
-        "JSUB":     {'opcode': '0x48', 'format': 3},
-        "LDA":      {'opcode': '0x00', 'format': 3},
-        "LDB":      {'opcode': '0x68', 'format': 3},
-        "LDCH":     {'opcode': '0x50', 'format': 3},
-        "LDT":      {'opcode': '0x74', 'format': 3},
-        "LDX":      {'opcode': '0x04', 'format': 3},
-        "RD":       {'opcode': '0xd8', 'format': 3},
-        "RSUB":     {'opcode': '0x4c', 'format': 3},
-        "STA":      {'opcode': '0x0c', 'format': 3},
-        "STCH":     {'opcode': '0x54', 'format': 3},
-        "STL":      {'opcode': '0x14', 'format': 3},
-        "STX":      {'opcode': '0x10', 'format': 3},
-        "TD":       {'opcode': '0xe0', 'format': 3},
-        "TIX":      {'opcode': '0x2c', 'format': 3},
-        "TIXR":     {'opcode': '0xb8', 'format': 2},
-        "WD":       {'opcode': '0xdc', 'format': 3}
-    }
+    __OPERAND_DIRECTIVES = frozenset(["BYTE", "WORD", "RESB", "RESW", "BASE", "EQU", "EXTDEF", "EXTREF"])
+
+    __DEFAULT_OPERATORS = (
+        ("CLEAR",   0xB4, 2),
+        ("COMP",    0x28, 3),
+        ("COMPR",   0xA0, 2),
+        ("J",       0x3C, 3),
+        ("JEQ",     0x30, 3),
+        ("JLT",     0x38, 3),
+        ("JSUB",    0x48, 3),
+        ("LDA",     0x00, 3),
+        ("LDB",     0x68, 3),
+        ("LDCH",    0x50, 3),
+        ("LDT",     0x74, 3),
+        ("LDX",     0x04, 3),
+        ("RD",      0xD8, 3),
+        ("RSUB",    0x4C, 3),
+        ("STA",     0x0C, 3),
+        ("STCH",    0x54, 3),
+        ("STL",     0x14, 3),
+        ("STX",     0x10, 3),
+        ("TD",      0xE0, 3),
+        ("TIX",     0x2C, 3),
+        ("TIXR",    0xB8, 2),
+        ("WD",      0xDC, 3),
+    )
 
     @property
     def source(self):
@@ -70,32 +110,164 @@ class Assembler:
     def object_program(self):
         return self.__program
 
-    def load_file(self, filename):
-        self.__source = []
-        self.__Symbols = {}
-        self.__Literals = {}
-        self.__begin_loc = None
-        self.__title = None
-        self.__base = None
-        self.__program = self.Record()
-        self.__block_name = []
-        self.__block_loc = {}
-        fin = open(filename, 'r', encoding="utf-8-sig")
-        if fin:
-            self.__source = fin.read().split('\n')
-            self.__source = [self.__parse(i) for i in self.__source]
-            self.__source = [uppercase(i) for i in self.__source]
-            while True:
+    @property
+    def relaxation(self):
+        return self.__relaxation
+
+    @property
+    def profiler(self):
+        return self.__profiler
+
+    @profiler.setter
+    def profiler(self, profiler):
+        self.__profiler = profiler
+
+    def load_file(self, filename, mapped=False, macros=None):
+        return self.__load(self.iter_file(filename, mapped, macros))
+
+    def load_source(self, text, macros=None):
+        # source given as a string instead of a file
+        lines = text.lstrip('\ufeff').splitlines()
+        return self.__load(self.iter_lines(macros.expand(lines) if macros is not None else lines))
+
+    def split_sections(self, text):
+        # source text of every control section, each closed by its own END; the first keeps START
+        parse = self.__get_parser().parse
+        sections = [[]]
+        code = False                # whether the current section has anything but comments
+        for lineno, text_line in enumerate(text.lstrip('\ufeff').splitlines(), 1):
+            try:
+                line = parse(text_line, lineno)
+            except TypeError:       # reported when the section is assembled
+                line = None
+            operator = line and line.mnemonic
+            if operator == 'END':
+                break
+            if operator == 'CSECT' and code:
+                sections.append([])
+            code = code or line is not None
+            sections[-1].append(text_line)
+        return ['\n'.join(lines + ["        END"]) + '\n' for lines in sections]
+
+    def has_sections(self, lines):
+        # whether a CSECT after the first statement starts another control section; only the lines that
+        # mention CSECT or END are parsed
+        parse = self.__get_parser().parse
+        code = False
+        for lineno, text_line in enumerate(lines, 1):
+            upper = text_line.upper()
+            if 'CSECT' in upper or 'END' in upper:
                 try:
-                    self.__source.remove(None)
-                except ValueError:
+                    line = parse(text_line, lineno)
+                except (SyntaxError, TypeError):    # reported when the source is assembled
+                    line = None
+                operator = line and line.mnemonic
+                if operator == 'END':
                     break
-        fin.close()
+                if operator == 'CSECT' and code:
+                    return True
+            code = code or bool(text_line.strip()) and text_line.lstrip()[0] != '.'
+        return False
+
+    @profiled('load_file')
+    def __load(self, lines):
+        self.__reset()
+        if self.__profiler is None:
+            self.__source = list(lines)
+            return self
+        parser = self.__get_parser()
+        regex_calls = parser.regex_calls
+        parser.count_calls(True)        # lines are parsed as the list is built
+        try:
+            self.__source = list(lines)
+        finally:
+            parser.count_calls(False)
+        self.__profiler.count('lines', len(self.__source))
+        self.__profiler.count('regex calls', parser.regex_calls - regex_calls)
         return self
 
+    def snapshot(self):
+        # everything pass two leaves behind, as plain data
+        return {
+            'begin': self.__begin_loc,
+            'end': self.__end_loc,
+            'SYMTAB': dict(self.__Symbols),
+            'LITERAL': dict(self.__Literals),
+            'absolute': [name for name, entry in self.__Symbols.entries.items() if entry.absolute],
+            'blocks': [[name, base] for name, base in zip(self.__block_name, self.__block_base)],
+            'object_program': str(self.__program),
+            'source': [[line.symbol, line.operator, line.operand, line.lineno] for line in self.__source],
+        }
+
+    def restore(self, state):
+        self.__reset()
+        self.__begin_loc = state['begin']
+        self.__end_loc = state['end']
+        absolute = set(state.get('absolute', ()))
+        for name, value in state['SYMTAB'].items():
+            self.__Symbols.define(name, None, value, absolute=name in absolute)
+        for name, value in state['LITERAL'].items():
+            self.__Literals.define(name, None, value)
+        for name, base in state['blocks']:
+            self.__block_id[name] = len(self.__block_name)
+            self.__block_name.append(name)
+            self.__block_base.append(base)
+        self.__program = self.Record.loads(state['object_program'])
+        self.__source = [self.Line(*line) for line in state.get('source', ())]     # as parsed, not laid out
+        return self
+
+    def iter_file(self, filename, mapped=False, macros=None):
+        # macros is a SICXE.macro.MacroProcessor whose expansion is streamed into the parser
+        if mapped:
+            lines = mapped_lines(filename)
+            yield from self.iter_lines(macros.expand(lines) if macros is not None else lines)
+            return
+        with open(filename, 'r', encoding="utf-8-sig") as fin:
+            yield from self.iter_lines(macros.expand(fin) if macros is not None else fin)
+
+    def parse_line(self, text, lineno=None):
+        # a Line, None for a comment or a blank line
+        return self.__get_parser().parse(text, lineno)
+
+    def iter_lines(self, lines):
+        # parse lazily, comments and blank lines never leave the generator
+        parse = self.__get_parser().parse
+        for lineno, line in enumerate(lines, 1):
+            line = parse(line, lineno)
+            if line is not None:
+                yield line
+
+    def image(self, filename=None):
+        # memory image from the start address to the end of the program, unused space is zero;
+        # with a filename it is written through an mmap of the preallocated file and its size is returned
+        if not self.__program.closed:
+            raise RuntimeError("need to do pass_two() first")
+        if self.__program.out is not None:
+            raise RuntimeError("object program was streamed, no code left for an image")
+        size = self.__end_loc - self.__begin_loc
+        if filename is None:
+            memory = bytearray(size)
+            self.__program.load_into(memory, self.__begin_loc)
+            return memory
+        with open(filename, 'w+b') as fout:
+            fout.truncate(size)
+            if size:
+                with mmap.mmap(fout.fileno(), size) as memory:
+                    self.__program.load_into(memory, self.__begin_loc)
+        return size
+
+    def __map_image(self, filename):
+        # the image file at its final size, mapped; None when the program is empty
+        size = self.__end_loc - self.__begin_loc
+        with open(filename, 'w+b') as fout:
+            fout.truncate(size)
+            return mmap.mmap(fout.fileno(), size) if size else None
+
     def append_operator(self, opname, opcode, opformat):
         if opname not in self.__OPERATORS:
-            self.__OPERATORS[opname] = {'opcode': opcode, 'format': opformat}
+            if type(opcode) is str:
+                opcode = int(opcode, 16)
+            self.__OPERATORS.add(opname, opcode, int(opformat))
             return {opname: self.__OPERATORS[opname]}
         return dict()
 
@@ -104,403 +276,1410 @@ class Assembler:
         op_table = fin.read()
         fin.close()
         op_table = op_table.split('|')
-        pattern = re.compile('^\s*((?P<opname>\w+?)\s*)?,\s*((?P<opcode>.+?)\s*)?,\s*((?P<format>\d+?)\s*)?$')
-        operators = dict()
+        pattern = re.compile(r'^\s*((?P<opname>\w+?)\s*)?,\s*((?P<opcode>.+?)\s*)?,\s*((?P<format>\d+?)\s*)?$')
+        operators = self.OperationTable()
 
         for op in op_table:
             match = pattern.match(op)
             if match:
-                operators[match.group('opname')] = {'opcode': hex(int(match.group('opcode'), 16)),
-                                                    'format': int(match.group('format'))}
+                operators.add(match.group('opname'), int(match.group('opcode'), 16), int(match.group('format')))
             op_table.remove(op)
 
         self.__OPERATORS = operators
         return operators
 
-    def pass_one(self):
+    @profiled('pass_one')
+    def pass_one(self, relax=False):
+        # with relax, format 3 instructions that cannot reach their operand are turned into format 4
         if not self.__source:
             raise RuntimeError("no source code in assembler, need to load_file() first")
         elif self.__begin_loc is not None:
             raise RuntimeError("pass_one have done before")
-        loc_ctr = 0
-        undef_literals = []
-        block_name = []
-        block_loc = {}
-        block_symbol = {}
-        now_block = ""
-
-        if self.__source[0]['operator'] == 'START':
-            if not self.__source[0]['operand']:
+        self.__layout()
+        if relax:
+            self.__relax()
+        if self.__profiler is not None:
+            self.__profiler.count('literal pools', len(self.__pools))
+            self.__profiler.count('literals', len(self.__Literals))
+        return self
+
+    def __layout(self):
+        layout = self.__start(self.__source[0])
+        for index, line in enumerate(self.__source):
+            pool = self.__place(line, layout)
+            if pool:                    # literal pool is placed right after this line
+                self.__pools[index] = pool
+        self.__close(layout)
+
+    @profiled('pass_one.relax')
+    def __relax(self):
+        # every instruction starts as format 3 and only ever grows, so this ends; after the first round
+        # only instructions whose reach spans one that grew are checked again
+        source = self.__source
+        blocks, bases, defined = [], [], {}
+        block, base = 0, None
+        for index, line in enumerate(source):
+            if line.mnemonic == 'USE':
+                block = self.__block_id[line.operand if line.operand else self.__block_name[0]]
+            elif line.mnemonic == 'BASE':
+                base = line.operand
+            blocks.append(block)
+            bases.append(base)
+            if line.symbol and (line.mnemonic != 'EQU' or line.operand == '*'):
+                defined[line.symbol] = index
+        for index, pool in self.__pools.items():
+            for literal in pool:
+                defined[literal] = index
+        moved = any(line.mnemonic == 'ORG' for line in source)     # line order is no longer address order
+
+        def reach(index):
+            # first and last line whose size can change the encoding, () if nothing can, None if unknown
+            line = source[index]
+            if type(line.target) is int:
+                return ()
+            if moved or type(line.target) is not str:
+                return None
+            points = [index, defined.get(line.target)]
+            if bases[index] is not None:
+                points.append(defined.get(bases[index]))
+            if None in points or any(blocks[i] != blocks[index] for i in points):
+                return None
+            return min(points), max(points)
+
+        candidates = [i for i, line in enumerate(source) if line.format == 3 and line.operand is not None]
+        reaches = {i: reach(i) for i in candidates}
+        work = candidates
+        grown_total = rounds = 0
+        while work:
+            rounds += 1
+            grown = [i for i in work if not self.__fits(source[i], blocks[i], bases[i])]
+            if not grown:
+                break
+            for i in grown:
+                line = source[i]
+                line.format = 4
+                line.extended = True
+                line.operator = '+' + line.operator
+            grown_total += len(grown)
+            self.__reset_layout()
+            self.__layout()
+            by_block = {}
+            for i in grown:
+                by_block.setdefault(blocks[i], []).append(i)
+            work = []
+            for i in candidates:
+                if source[i].format != 3 or reaches[i] == ():
+                    continue
+                if reaches[i] is not None:
+                    first, last = reaches[i]
+                    lines = by_block.get(blocks[i], ())
+                    k = bisect.bisect_left(lines, first)
+                    if k == len(lines) or lines[k] > last:
+                        continue
+                work.append(i)
+        self.__relaxation = {'candidates': len(candidates), 'grown': grown_total,
+                             'saved': len(candidates) - grown_total, 'rounds': rounds}
+        if self.__profiler is not None:
+            self.__profiler.count('relaxed to format 4', grown_total)
+
+    def __fits(self, line, block, base):
+        try:
+            code, modifications = self.__try_encode(line, None, self.__block_base[block] + line.loc, base, final=True)
+        except SyntaxError:         # out of reach, or an external reference
+            return False
+        # the SIC format fallback would lose the n and i bits, format 4 keeps them
+        return not any(form == 3 for form, symbol in modifications)
+
+    def __start(self, first):
+        self.__begin_loc = 0
+        if first.operator == 'START':
+            if not first.operand:
                 raise TypeError("START takes exactly one argument (0 given)")
             try:
-                self.__begin_loc = int(self.__source[0]['operand'], 16)
+                self.__begin_loc = int(first.operand, 16)
             except ValueError:
                 raise ValueError("START address need to be a number")
+        self.__block_name.append(first.symbol if first.operator in ('START', 'CSECT') else None)
+        return self.Layout(self.__block_name[0], first)
 
-            loc_ctr = self.__begin_loc
-            block_name.append(self.source[0]['symbol'])
-            block_loc[self.__source[0]['symbol']] = loc_ctr
-            now_block = block_name[0]
-            block_symbol[now_block] = []
-        for line in self.__source:
-            symbol, operator, operand = line['symbol'], line['operator'], line['operand']
-            if symbol and symbol != '*':
-                if symbol in self.__Symbols:
-                    raise KeyError("Duplicate symbol {}".format(symbol))
-                self.__Symbols[symbol] = loc_ctr
-                block_symbol[now_block].append(symbol)
-            line['loc'] = loc_ctr
-
-            if operand and re.match('^=\S+$', operand):
-                if operand not in undef_literals and operand not in self.__Literals:
-                    undef_literals.append(operand)
-
-            if operator in self.__DIRECTIVES:
-                if operator == 'WORD':
-                    loc_ctr += 3
-                elif operator == 'RESW':
-                    loc_ctr += int(line['operand']) * 3
-                elif operator == 'RESB':
-                    loc_ctr += int(line['operand'])
-                elif operator == 'BYTE':
-                    loc_ctr += len(constant(line['operand'])) // 2
-                elif operator == 'EQU':
-                    if operand == '*':
-                        self.__Symbols[symbol] = loc_ctr
-                    elif re.match('^\d+$', operand):
-                        self.__Symbols[symbol] = int(operand)
-                    elif operand in self.__Symbols or re.match('\S+\s*-\s*\S+', operand):
-                        self.__Symbols[symbol] = operand
-                    else:
-                        self.__Symbols[symbol] = None
-                        raise TypeError("invalid value for EQU: {}".format(operand))
-                elif operator == 'ORG':
-                    if re.match('^\d+$', operand):
-                        loc_ctr = int(operand)
-                    elif operand in self.__Symbols:
-                        loc_ctr = self.__Symbols[operand]
-                    elif re.match('\S+\s*\+\s*\S', operand):
-                        operand1, operand2 = re.split('\s*\+\s*')
-                        if operand1 in self.__Symbols:
-                            if re.match('^\d+$', operand2):
-                                loc_ctr = self.__Symbols[operand1] + int(operand2)
-                            elif operand2 in self.__Symbols:
-                                loc_ctr = self.__Symbols[operand1] + self.__Symbols[operand2]
-                            else:
-                                raise TypeError("undefined symbol: {}".format(operand2))
-                        else:
-                            raise TypeError("undefined symbol: {}".format(operand1))
+    def __place(self, line, layout):
+        # give line its block offset and define its symbols, returns the literal pool placed after it
+        symbol, operator, operand = line.symbol, line.mnemonic, line.operand
+        loc_ctr = layout.loc
+        pool = None
+        if symbol and operator != 'EQU':
+            self.__Symbols.define(symbol, layout.block, loc_ctr)
+        line.loc = loc_ctr
+
+        if line.literal:
+            if operand not in layout.literals and operand not in self.__Literals:
+                layout.literals.append(operand)
+
+        if line.format:
+            if line.extended and line.format != 4:
+                raise SyntaxError("invalid operator format from {} to 4".format(self.__OPERATORS[operator]))
+            loc_ctr += line.format
+        elif operator in self.__DIRECTIVES:
+            if operand is None and operator in self.__OPERAND_DIRECTIVES:
+                raise SyntaxError("missing operand for {}".format(operator))
+            if operator == 'WORD':
+                loc_ctr += 3
+            elif operator == 'RESW':
+                loc_ctr += int(operand) * 3
+            elif operator == 'RESB':
+                loc_ctr += int(operand)
+            elif operator == 'BYTE':
+                loc_ctr += len(constant(operand))
+            elif operator == 'EQU':
+                if operand == '*':
+                    self.__Symbols.define(symbol, layout.block, loc_ctr)
+                elif operand.isdecimal():
+                    self.__Symbols.define(symbol, None, int(operand), absolute=True)
+                else:                   # evaluated once the block layout is known
+                    self.__Symbols.define_expression(symbol, self.Expression.compile(operand), layout.block, loc_ctr)
+            elif operator == 'ORG':
+                if operand is None:     # back to the location counter before the last ORG with an operand
+                    if layout.org is None:
+                        raise SyntaxError("ORG without an operand needs an ORG with one before it")
+                    block, loc_ctr = layout.org
+                    if block != layout.block:
+                        raise SyntaxError("ORG without an operand in another program block than its ORG")
+                    layout.org = None
+                else:
+                    # symbols count by their offset, so they have to be in the block of the location counter
+                    value, relative = self.Expression.compile(operand).evaluate(
+                        lambda name: self.__offset(name, layout.block), loc_ctr)
+                    if relative == 1:
+                        layout.org = (layout.block, loc_ctr)
+                        loc_ctr = value
+                    elif relative == 0:
+                        if layout.block != 0:   # where a later block starts is only known after the layout
+                            raise SyntaxError("ORG to an absolute address outside the default program block")
+                        layout.org = (layout.block, loc_ctr)
+                        loc_ctr = value - self.__begin_loc
                     else:
                         raise TypeError("invalid value for ORG: {}".format(operand))
-                elif operator == 'LTORG' or operator == 'END':
-                    index = self.__source.index(line)
-                    for i, literal in enumerate(undef_literals):
-                        self.__source.insert(index+i+1, {'symbol': '*', 'operator': literal, 'operand': None})
-                        block_symbol[now_block].append(literal)
-                    undef_literals.clear()
-                elif operator == 'USE':                             # program block
-                    block_loc[now_block] = loc_ctr
-                    if operand is None:
-                        loc_ctr = block_loc[block_name[0]]
-                        now_block = block_name[0]
+            elif operator == 'LTORG' or operator == 'END':
+                if layout.literals:
+                    pool = layout.literals
+                    for literal in pool:
+                        self.__Literals.define(literal, layout.block, loc_ctr)
+                        loc_ctr += len(constant(literal[1:]))
+                    layout.literals = []
+            elif operator == 'USE':                             # program block
+                layout.block_len[layout.block] = loc_ctr
+                name = operand if operand is not None else self.__block_name[0]
+                if name not in layout.block_id:
+                    layout.block_id[name] = len(self.__block_name)
+                    self.__block_name.append(name)
+                    layout.block_len.append(0)
+                layout.block = layout.block_id[name]
+                loc_ctr = line.loc = layout.block_len[layout.block]
+            elif operator == 'EXTDEF' or operator == 'EXTREF':
+                for name in operand.split(','):
+                    name = name.strip()
+                    if len(name) > 6:
+                        raise SyntaxError("external symbol {} is longer than 6 characters".format(name))
+                    if operator == 'EXTDEF':
+                        self.__exports.append(name)
+                    elif name in self.__Symbols or name in self.__externals:
+                        raise KeyError("Duplicate symbol {}".format(name))
                     else:
-                        now_block = operand
-                        if operand in block_name:
-                            loc_ctr = block_loc[operand]
-                        else:
-                            block_name.append(operand)
-                            loc_ctr = self.__begin_loc
-                            block_loc[operand] = loc_ctr
-                            block_symbol[operand] = []
-                else:
-                    pass
-            elif operator in self.__OPERATORS:
-                loc_ctr += int(self.__OPERATORS[operator]['format'])
-            elif operator[0] == '+' and operator[1:] in self.__OPERATORS:
-                if self.__OPERATORS[operator[1:]]['format'] == 3:
-                    loc_ctr += 4
-                else:
-                    raise SyntaxError("invalid operator format from {} to 4".format(self.__OPERATORS[operator[1:]]))
-            elif re.match('^=\S+$', operator):
-                self.__Literals[operator] = loc_ctr
-                loc_ctr += len(constant(operator[1:])) // 2
-        # fix program block's location
-        block_loc[now_block] = loc_ctr
-        tmp_loc = self.__begin_loc
-        for x in block_name:
-            block_loc[x], tmp_loc = tmp_loc, block_loc[x]+tmp_loc
-            for i in block_symbol[x]:
-                if i in self.__Symbols.keys():
-                    # fix symbol-defining statement
-                    if type(self.__Symbols[i]) is str:
-                        label = self.__Symbols[i]
-                        if label in self.__Symbols.keys():
-                            self.__Symbols[i] = self.__Symbols[label]
-                        else:
-                            label1, label2 = re.split('\s*-\s*', label)
-                            if label1 in self.__Symbols and label2 in self.__Symbols and self.__Symbols[label1]-self.__Symbols[label2] >= 0:
-                                self.__Symbols[i] = "{:04X}".format(self.__Symbols[label1]-self.__Symbols[label2])
-                                #   Absolute value save by string
-                            else:
-                                raise TypeError("undefined symbol: {}, {}".format(label1, label2))
-                    # ------------------------
-                    else:
-                        self.__Symbols[i] += block_loc[x]
-                else:
-                    self.__Literals[i] += block_loc[x]
+                        self.__externals[name] = None
+            elif operator == 'CSECT':
+                if line is not layout.first:    # a CSECT is assembled on its own, see SICXE.linker
+                    raise SyntaxError("CSECT {} starts another control section, split the source with SICXE.linker"
+                                      .format(symbol))
+            else:
+                pass
+        layout.loc = loc_ctr
+        return pool
 
-        self.__block_name = block_name
-        self.__block_loc = block_loc
-        return self
+    def __close(self, layout, changed=(), previous=None):
+        layout.block_len[layout.block] = layout.loc
+        # program blocks are laid out one after another in order of first appearance
+        start = self.__begin_loc
+        for length in layout.block_len:
+            self.__block_base.append(start)
+            start += length
+        self.__end_loc = start
+        self.__block_id = layout.block_id
+        return self.__resolve_symbols(changed, previous)
+
+    # pass one a line at a time, for SICXE.document: start_layout(), place() every line, close_layout();
+    # mark_layout() between lines, rewind_layout() goes back to a mark once the layout is closed and
+    # resume_layout() skips the lines that would be placed the same as before
+    def start_layout(self, first):
+        self.__reset_layout()
+        return self.__start(first)
+
+    def place(self, line, layout):
+        return self.__place(line, layout)
+
+    def close_layout(self, layout, changed=(), previous=None):
+        # changed: names dropped or defined since the layout was rewound; the EQU symbols that depend on
+        # them, or on a program block that moved, are evaluated again and their old addresses go into previous
+        self.rewind_rest()
+        bases = self.__block_base[:]
+        del self.__block_base[:]        # the symbol tables hold this list
+        layout.block_len[layout.block] = layout.loc
+        start = self.__begin_loc
+        moved = set()
+        for block, length in enumerate(layout.block_len):
+            if block < len(bases) and bases[block] != start:
+                moved.add(block)
+            start += length
+        if moved:
+            changed = set(changed)
+            changed.update(name for name, entry in self.__Symbols.entries.items() if entry.block in moved)
+            changed.update(name for name, (expression, block, offset) in self.__Symbols.expressions.items()
+                           if block in moved)
+        return self.__close(layout, changed, previous)
+
+    def mark_layout(self, layout):
+        return self.LayoutMark(layout, len(self.__block_name), self.__Symbols.mark(), self.__Literals.mark(),
+                               len(self.__exports), len(self.__externals))
+
+    def rewind_layout(self, mark, until=None):
+        # a layout to place the line at mark again, and what the lines after it had defined; with until, a
+        # later mark, the tables are only rewound that far until rewind_rest()
+        dropped = (self.__Symbols.rewind(mark.symbols, until and until.symbols),
+                   self.__Literals.rewind(mark.pooled, until and until.pooled),
+                   self.__block_name[mark.blocks:], self.__exports[mark.exports:],
+                   list(self.__externals)[mark.externals:])
+        del self.__block_name[mark.blocks:]
+        del self.__exports[mark.exports:]
+        for name in dropped[4]:
+            del self.__externals[name]
+        return self.__marked_layout(mark), dropped
 
-    def pass_two(self):
+    def rewind_rest(self):
+        # the rest of a rewind_layout() with until, dropped onto the lists it returned
+        self.__Symbols.rewind_rest()
+        self.__Literals.rewind_rest()
+
+    def resume_layout(self, mark, dropped, old, final):
+        # old is a mark taken before the layout was rewound to mark, and the lines placed since then defined the
+        # same symbols and literals as the lines up to old did: what was dropped after old is put back and the
+        # layout at final is returned, the lines after old would be placed as before; None when the program
+        # blocks or external symbols differ
+        symbols, literals, names, exports, externals = dropped
+        if not (self.__block_name[mark.blocks:] == names[:old.blocks - mark.blocks]
+                and self.__exports[mark.exports:] == exports[:old.exports - mark.exports]
+                and list(self.__externals)[mark.externals:] == externals[:old.externals - mark.externals]):
+            return None
+        self.__Symbols.resume(symbols, mark.symbols, old.symbols)
+        self.__Literals.resume(literals, mark.pooled, old.pooled)
+        self.__block_name.extend(names[old.blocks - mark.blocks:])
+        self.__exports.extend(exports[old.exports - mark.exports:])
+        self.__externals.update(dict.fromkeys(externals[old.externals - mark.externals:]))
+        return self.__marked_layout(final)
+
+    def __marked_layout(self, mark):
+        layout = self.Layout(None, mark.first)
+        layout.loc, layout.block, layout.block_id = mark.loc, mark.block, dict(mark.block_id)
+        layout.block_len, layout.literals = list(mark.block_len), list(mark.literals)
+        layout.org = mark.org
+        return layout
+
+    def check(self, line, block, base):
+        # the error pass two would raise for a placed line, or None
+        try:
+            if line.format == 2:
+                self.__encode_registers(line)
+            elif line.format or line.mnemonic == 'WORD':
+                self.__try_encode(line, None, self.__block_base[block] + line.loc, base, final=True)
+            elif line.mnemonic == 'EXTDEF':
+                for name in line.operand.split(','):
+                    if name.strip() not in self.__Symbols:
+                        raise TypeError("undefined symbol: {}".format(name.strip()))
+        except (SyntaxError, TypeError, KeyError, ValueError) as e:
+            return "{}: {}".format(type(e).__name__, e)
+        return None
+
+    def __offset(self, name, block):
+        # EQU expressions are not evaluated before the block layout is known
+        self.__Symbols.reveal(name)
+        entry = self.__Symbols.entries.get(name)
+        if entry is None or name in self.__Symbols.expressions:
+            raise TypeError("undefined symbol: {}".format(name))
+        if not entry.absolute and entry.block != block:
+            raise TypeError("ORG operand {} is in another program block".format(name))
+        return entry.offset, 0 if entry.absolute else 1
+
+    def __evaluate(self, expression, location):
+        # (value, absolute, external terms like '+NAME') of an expression, None while an address is unknown
+        values = {}
+        externals = []
+        for name in expression.symbols:
+            if name in self.__externals:
+                values[name] = (0, 0)       # the loader adds its address through a modification record
+                externals.append(name)
+                continue
+            entry = self.__Symbols.entries.get(name)
+            address = entry and self.__address(entry.block, entry.offset)
+            if address is None:
+                return None
+            values[name] = (address, 0 if entry.absolute else 1)
+        if expression.location and location is None:
+            return None
+        value, relative = expression.evaluate(values.__getitem__, location)
+        if relative not in (0, 1):
+            raise TypeError("invalid relative expression: {}".format(expression.text))
+        terms = []
+        for name in externals:
+            values[name] = (1, 0)
+            sign = expression.evaluate(values.__getitem__, location)[0] - value
+            values[name] = (0, 0)
+            if sign not in (1, -1):
+                raise TypeError("invalid use of external symbol {} in {}".format(name, expression.text))
+            terms.append(('+' if sign > 0 else '-') + name)
+        return value, not relative, terms
+
+    @profiled('pass_one.fixup')
+    def __resolve_symbols(self, changed=(), previous=None):
+        return self.__Symbols.resolve(changed, previous)
+
+    @profiled('pass_two')
+    def pass_two(self, out=None, listing=None, image=None):
+        # image: file the memory image is written to through an mmap while the code is encoded
         if not self.__source:
             raise RuntimeError("no source code in assembler, need to load_file() first")
         elif self.__begin_loc is None:
             raise RuntimeError("need to do pass_one() first")
         elif self.__program.header:
             raise RuntimeError("pass_two have done before")
-        self.__title = self.__source[0]['symbol'] if self.__source[0]['operator'] == 'START' else None
-        self.__program.add_header(self.__title, self.__begin_loc)   # write header record
-
-        def format_type(operator):
-            if operator[0] == '+' and operator[1:] in self.__OPERATORS.keys() and self.__OPERATORS[operator[1:]]['format'] == 3:
-                return 4
-            elif operator in self.__DIRECTIVES or operator[0] == '=':       # literal & directives
-                return 0
-            elif operator[0] == '+':
-                raise SyntaxError("format {} cannot convert to format 4".format(self.__OPERATORS[operator[1:]]['format']))
-            else:
-                return self.__OPERATORS[operator]['format']
+        if out is not None:
+            self.__program = self.Record(out)     # records are written to out as soon as they are complete
+        if listing is not None:
+            listing = self.Listing(listing)
+        memory = self.__map_image(image) if image is not None else None
+        if memory is not None:
+            self.__program.image = (memory, self.__begin_loc)
+        try:
+            self.__add_header(self.__source[0])
 
-        def pure_operator(operator):
-            if operator[0] == '+':
-                operator = operator[1:]
-            return operator
+            def flush_pool(index, location):
+                for literal in self.__pools.get(index, ()):
+                    opvalue = constant(literal[1:])
+                    location = self.__Literals[literal]
+                    self.__program.add_text(opvalue, location)
+                    if listing is not None:
+                        listing.add_literal(literal, location, opvalue)
+                    location += len(opvalue)
+                return location
 
-        def operand_pair(operand):
-            if operand is None:
-                return [None]
-            reg = re.compile("(?P<operand1>\w+)\s*,?\s*(?P<operand2>\w+)?")
-            if reg.match(operand):
-                return reg.match(operand).groups()
-            else:
-                return [operand]
-
-        def pure_operand(operand):
-            operand = re.match("^(@|#|)?(?P<operand>\S+)$", operand)
-            operand = operand.group('operand')
-            if re.match("^\d+$", operand):
-                return int(operand)
-            elif operand in self.__Symbols.keys():
-                return self.__Symbols[operand]
-            elif operand in self.__Literals.keys():
-                return self.__Literals[operand]
-            else:
-                raise TypeError("undefined symbol: {}".format(operand))
-
-        now_block = self.__title
-        for line in self.__source:
-            operator, operand, location = line['operator'], line['operand'], line['loc']
-            location += self.__block_loc[now_block]     # for program block
-            line['loc'] = location                        # for program block
-            format_t = format_type(operator)
-            operator = pure_operator(operator)
-            flag_ni = '11'          # default n=1, i=1
-            flag_x = '0'
-            flag_b = '0'
-            flag_p = '0'
-            flag_e = '1' if format_t == 4 else '0'
-            flag_xbpe = flag_x + flag_b + flag_p + flag_e     # default x, b, p, e = 0, 0, 0, 0
-            opcode = ""
-            opvalue = ""
-            if not format_t:
-                if operator == 'BASE':
-                    self.__base = self.__Symbols[operand]
+            block_base = self.__block_base[0]
+            base = None                 # operand of the last BASE
+            for index, line in enumerate(self.__source):
+                operator, operand = line.mnemonic, line.operand
+                if operator == 'USE':
+                    block_base = self.__block_base[self.__block_id[operand if operand else self.__block_name[0]]]
+                location = line.loc = line.loc + block_base     # block offset to address
+                code = b''
+                if line.format == 2:
+                    code = self.__encode_registers(line)
+                    self.__program.add_text(code, location)
+                elif line.format or operator == 'WORD':
+                    code, modifications = self.__try_encode(line, None, location, base, final=True)
+                    for form, symbol in modifications:
+                        self.__program.add_modification(location, form=form, symbol=symbol)
+                    self.__program.add_text(code, location)
+                elif operator == 'BASE':
+                    base = operand
                 elif operator == 'BYTE':
-                    opvalue = constant(operand)
-                elif operator == 'END':
-                    self.__program.add_end(location)    # write end record
-                    break
-                elif operator in self.__Literals.keys():    # Literal
-                    opvalue = constant(operator[1:])
-                elif operator == 'USE':
-                    location -= self.__block_loc[now_block]
-                    now_block = operand if operand else self.__title
-                    location += self.__block_loc[now_block]
-                    line['loc'] = location
-                    self.__program.add_text(opcode, opvalue, location)
-
-            elif operator in self.__OPERATORS:
-                operands = operand_pair(operand)
-                operand = operands[0]
-                if format_t == 2:
-                    flag_ni = '00'
-                    r1 = operands[0]
-                    r2 = operands[1] if len(operands) > 1 else None
-                    if r1 in self.__REGISTERS:
-                        r1 = "{:X}".format(self.__REGISTERS[r1])
-                        r2 = "{:X}".format(self.__REGISTERS[r2]) if r2 in self.__REGISTERS else "0"
-                        opvalue = r1 + r2
+                    code = constant(operand)
+                    self.__program.add_text(code, location)
+                if listing is not None:
+                    value = self.__Symbols[line.symbol] if operator == 'EQU' and line.symbol in self.__Symbols else None
+                    listing.add(line, location, code, value)
+                if operator == 'END' or operator == 'LTORG':
+                    flush_pool(index, location)
+                    if operator == 'END':
+                        break
+
+            self.__program.add_end()        # write end record
+            if listing is not None:
+                listing.close(self.__Symbols)
+            if self.__profiler is not None:
+                self.__profiler.count('text records', self.__program.records)
+                self.__profiler.count('modification records', len(self.__program.modifications))
+        finally:
+            if memory is not None:
+                self.__program.image = None
+                memory.close()
+        return self
+
+    def __add_header(self, first):
+        # H record, then D and R records of a control section; a CSECT has no entry address in its E record
+        section = first.operator == 'CSECT'
+        self.__title = first.symbol if first.operator == 'START' or section else None
+        program = self.__program
+        program.add_header(self.__title, self.__begin_loc, self.__end_loc - self.__begin_loc)
+        if section:
+            program.entry = None
+        definitions = []
+        for name in self.__exports:
+            if name not in self.__Symbols:
+                raise TypeError("undefined symbol: {}".format(name))
+            definitions.append((name, self.__Symbols[name]))
+        program.add_definitions(definitions)
+        program.add_references(list(self.__externals))
+
+    @profiled('one_pass')
+    def one_pass(self, filename, out=None, mapped=False, macros=None):
+        # both passes in one traversal of the file, no source list is kept; code whose operand is not
+        # known yet is emitted as zeros and patched when the symbol is defined, or once the block layout is known
+        self.__reset()
+        if out is not None:
+            self.__program = self.Record(out)
+        code = bytearray()
+        blocks, offsets, starts = array('I'), array('q'), array('Q')     # block, offset and code start of every item
+        modifications = {}          # item -> [(form, symbol)] of its modification records
+        forward = {}                # undefined symbol or literal -> [(item, line, block, offset, base)]
+        deferred = []               # fixups waiting for the block layout
+        base = None                 # operand of the last BASE
+        layout = None
+        ended = False
+        lines = 0
+
+        def emit(block, offset, object_code):
+            blocks.append(block)
+            offsets.append(offset)
+            starts.append(len(code))
+            code.extend(object_code)
+            return len(starts) - 1
+
+        def patch(item, result):
+            object_code, forms = result
+            code[starts[item]:starts[item] + len(object_code)] = object_code
+            if forms:
+                modifications[item] = forms
+
+        def wake(name):
+            for fixup in forward.pop(name, ()):
+                result = self.__try_encode(*fixup[1:])
+                if result is None:
+                    deferred.append(fixup)
+                else:
+                    patch(fixup[0], result)
+
+        for line in self.iter_file(filename, mapped, macros):
+            lines += 1
+            if layout is None:
+                layout = self.__start(line)
+                first = line
+            block = layout.block
+            pool = self.__place(line, layout)
+            if line.symbol in self.__Symbols.entries:
+                wake(line.symbol)
+            if ended:                   # lines after END are laid out but not assembled, as in pass two
+                continue
+            operator = line.mnemonic
+            if line.format == 2:
+                emit(block, line.loc, self.__encode_registers(line))
+            elif line.format or operator == 'WORD':
+                result = self.__try_encode(line, block, line.loc, base)
+                if result is None:
+                    fixup = (emit(block, line.loc, bytes(line.format or 3)), line, block, line.loc, base)
+                    table = self.__Literals if line.literal else self.__Symbols
+                    if line.target in table.entries or type(line.target) is not str:
+                        deferred.append(fixup)
                     else:
-                        raise SyntaxError("no register {}".format(r1))
-                elif operand is not None:
-                    if operand[0] == '@':
-                        flag_ni = '10'
-                        operands[0] = operand[1:]
-                    elif operand[0] == '#':
-                        flag_ni = '01'
-                        operands[0] = operand[1:]
-
-                    operand = pure_operand(operand)         # only number
-                    absolute_value = False
-                    if operands[0] in self.__Symbols.keys() or operands[0] in self.__Literals.keys():
-                        if len(operands) > 1 and operands[1] == 'X':
-                            flag_x = '1'
-                        if type(operand) is str:
-                            absolute_value = True
-                            operand = int(operand, 16)
-                            self.__Symbols[operands[0]] = operand  # change to number after use
-                        if format_t == 4:
-                            if not absolute_value:
-                                opvalue = "{:06X}".format(operand)
-                                self.__program.add_modification(location)
-                        elif -2048 <= operand-location-format_t < 2048:       # PC counter
-                            flag_p = '1'
-                            flag_xbpe = flag_x + flag_b + flag_p + flag_e
-                            opvalue = "{:04X}".format(operand-location-format_t & int('FFFF', 16))
-                        elif not self.__base:
-                            flag_ni = '00'
-                            opvalue = "{:04X}".format(operand)
-                            self.__program.add_modification(location, form=3)
-                        elif 0 <= operand-self.__base < 4096:
-                            flag_b = '1'
-                            flag_xbpe = flag_x + flag_b + flag_p + flag_e
-                            opvalue = "{:04X}".format(operand-self.__base)
-                        else:
-                            raise SyntaxError("need to transform to format 4")
-                    else:       # when operand is number
-                        opvalue = "{:06X}".format(operand) if format_t == 4 else "{:04X}".format(operand)
-                    opvalue = "{:X}".format(int(flag_xbpe, 2)) + opvalue[1:]
+                        forward.setdefault(line.target, []).append(fixup)
                 else:
-                    opvalue = "0000"
-                opcode = int(self.__OPERATORS[operator]['opcode'], 16) + int(flag_ni, 2)    # set flag n i
-                opcode = "{:02X}".format(opcode)                                            # transform to hex
-            if opcode or opvalue:
-                self.__program.add_text(opcode, opvalue, location)    # write text record opcode, opvalue, location
+                    patch(emit(block, line.loc, result[0]), result)
+            elif operator == 'BYTE':
+                emit(block, line.loc, constant(line.operand))
+            elif operator == 'BASE':
+                base = line.operand
+            elif operator == 'END':
+                ended = True
+            for literal in pool or ():
+                entry = self.__Literals.entries[literal]
+                emit(entry.block, entry.offset, constant(literal[1:]))
+                wake(literal)
+        if layout is None:
+            raise RuntimeError("no source code in {}".format(filename))
+        self.__close(layout)
+        for chain in forward.values():
+            deferred.extend(chain)
+        for fixup in deferred:
+            patch(fixup[0], self.__try_encode(*fixup[1:], final=True))
 
+        # replay the items in source order, the records come out the same as from pass two
+        program = self.__program
+        self.__add_header(first)
+        starts.append(len(code))
+        view = memoryview(code)
+        for item in range(len(blocks)):
+            location = self.__block_base[blocks[item]] + offsets[item]
+            for form, symbol in modifications.get(item, ()):
+                program.add_modification(location, form=form, symbol=symbol)
+            program.add_text(view[starts[item]:starts[item+1]], location)
+        view.release()
+        program.add_end()
+        if self.__profiler is not None:
+            self.__profiler.count('lines', lines)
+            self.__profiler.count('forward references', len(deferred))
+            self.__profiler.count('text records', program.records)
+            self.__profiler.count('modification records', len(program.modifications))
         return self
 
-    def __parse(self, line):
-        def is_comment():
-            if re.match('^\s*\..*', line):
-                return True
-            return False
+    def __address(self, block, offset):
+        # None while the start of the block is not known
+        if block is None:
+            return offset
+        if block < len(self.__block_base):
+            return self.__block_base[block] + offset
+        if block == 0:
+            return self.__begin_loc + offset
+        return None
 
-        def is_code():
-            symbol = '^\s*((?P<symbol>\w+)\s+)?'
-            operator = '|'.join(list(self.__OPERATORS.keys()) + self.__DIRECTIVES)
-            operator = '(?P<operator>\+?({}))'.format(operator)
-            operand = '(\s+(?P<operand>(\S+(\s*\S\s*\S+)?)))?\s*$'
-            rule = re.compile(symbol+operator+operand)
-            result = rule.match(line)
-            if result:
-                return result.groupdict()
-            return False
+    def __try_encode(self, line, block, offset, base, final=False):
+        # object code of a format 3/4 instruction or WORD and its [(form, symbol)] modification records,
+        # or None while an address it depends on is unknown
+        if not line.format:
+            return self.__encode_word(line, block, offset, final)
+        target = line.target
+        externals = ()
+        location = self.__address(block, offset)
+        if target is None or type(target) is int:
+            value, absolute = target, True
+        elif type(target) is self.Expression:
+            result = self.__evaluate(target, location)
+            if result is None:
+                if final:
+                    raise TypeError("undefined symbol in {}".format(line.operand))
+                return None
+            value, absolute, externals = result
+        elif target in self.__externals:
+            value, absolute, externals = 0, True, ('+' + target,)
+        else:
+            table = self.__Literals if line.literal else self.__Symbols
+            entry = table.entries.get(target)
+            if entry is None:
+                if final:
+                    raise TypeError("undefined symbol: {}".format(target))
+                return None
+            value, absolute = self.__address(entry.block, entry.offset), entry.absolute
+            if value is None or location is None and not absolute:
+                # the same block: PC relative only needs the distance
+                if entry.block != block or line.format != 3 or not -2048 <= entry.offset - offset - 3 < 2048:
+                    return None
+                return self.__encode(line, offset, entry.offset, False)[0], []
+        if externals and line.format != 4:
+            raise SyntaxError("external reference in {} needs format 4".format(line.operand))
+        if not absolute:
+            if location is None:
+                return None
+            if line.format == 3 and not -2048 <= value - location - 3 < 2048:
+                self.__base = None
+                if base is not None:
+                    entry = self.__Symbols.entries.get(base)
+                    self.__base = entry and self.__address(entry.block, entry.offset)
+                    if self.__base is None:
+                        if final:
+                            raise TypeError("undefined symbol: {}".format(base))
+                        return None
+        code, form = self.__encode(line, offset if location is None else location, value, absolute)
+        return code, ([(form, None)] if form else []) + [(4, symbol) for symbol in externals]
 
-        def is_space():
-            if re.match('^\s*$', line):
-                return True
-            return False
+    def __encode_word(self, line, block, offset, final):
+        result = self.__evaluate(self.Expression.compile(line.operand), self.__address(block, offset))
+        if result is None:
+            if final:
+                raise TypeError("undefined symbol in {}".format(line.operand))
+            return None
+        value, absolute, externals = result
+        forms = [] if absolute else [(3, None)]
+        return (value & 0xFFFFFF).to_bytes(3, 'big'), forms + [(3, symbol) for symbol in externals]
+
+    def __encode_registers(self, line):
+        if line.target not in self.__REGISTERS:
+            raise SyntaxError("no register {}".format(line.target))
+        r2 = self.__REGISTERS.get(line.operand2, 0)
+        return bytes((self.__OPERATORS.opcode(line.opid), self.__REGISTERS[line.target] << 4 | r2))
+
+    def __encode(self, line, location, value, absolute):
+        # returns object code of a format 3/4 instruction and the form of its modification record
+        opcode = self.__OPERATORS.opcode(line.opid)
+        ni = line.ni
+        x = 0x8 if line.indexed else 0
+        if line.format == 4:
+            address = 0 if value is None else value & 0xFFFFF
+            word = (opcode | ni) << 24 | (x | 0x1) << 20 | address
+            return word.to_bytes(4, 'big'), None if absolute else 4
+        if value is None:
+            return ((opcode | ni) << 16).to_bytes(3, 'big'), None
+        if absolute:
+            if not -2048 <= value < 4096:
+                raise SyntaxError("need to transform to format 4")
+            return ((opcode | ni) << 16 | x << 12 | value & 0xFFF).to_bytes(3, 'big'), None
+        displacement = value - location - 3
+        if -2048 <= displacement < 2048:       # PC relative
+            word = (opcode | ni) << 16 | (x | 0x2) << 12 | displacement & 0xFFF
+        elif not self.__base:                   # SIC format
+            return (opcode << 16 | x << 12 | value & 0x7FFF).to_bytes(3, 'big'), 3
+        elif 0 <= value - self.__base < 4096:  # BASE relative
+            word = (opcode | ni) << 16 | (x | 0x4) << 12 | value - self.__base
+        else:
+            raise SyntaxError("need to transform to format 4")
+        return word.to_bytes(3, 'big'), None
+
+    def __get_parser(self):
+        parser = self.__parser
+        if parser is None or parser.optab is not self.__OPERATORS or parser.version != self.__OPERATORS.version:
+            parser = self.__parser = self.Parser(self.__OPERATORS, self.__DIRECTIVES)      # OPTAB changed
+        return parser
+
+    class OperationTable(Mapping):
+        def __init__(self, operators=()):
+            self.ids = {}
+            self.names = []
+            self.opcodes = bytearray()
+            self.formats = bytearray()
+            self.version = 0
+            for name, opcode, op_format in operators:
+                self.add(name, opcode, op_format)
 
-        comment = is_comment()
-        space = is_space()
-        code = is_code()
-        if not comment and not space:
-            if code:
-                return code
+        def add(self, name, opcode, op_format):
+            opid = self.ids.get(name)
+            if opid is None:
+                opid = self.ids[name] = len(self.names)
+                self.names.append(name)
+                self.opcodes.append(opcode)
+                self.formats.append(op_format)
+            else:
+                self.opcodes[opid] = opcode
+                self.formats[opid] = op_format
+            self.version += 1
+            return opid
+
+        def opcode(self, opid):
+            return self.opcodes[opid]
+
+        def format(self, opid):
+            return self.formats[opid]
+
+        def __getitem__(self, name):    # the old {'opcode': '0xb4', 'format': 2} view
+            opid = self.ids[name]
+            return {'opcode': hex(self.opcodes[opid]), 'format': self.formats[opid]}
+
+        def __contains__(self, name):
+            return name in self.ids
+
+        def __iter__(self):
+            return iter(self.names)
+
+        def __len__(self):
+            return len(self.names)
+
+        def __repr__(self):
+            return repr(dict(self.items()))
+
+    class Layout:
+        # pass one state between lines
+        __slots__ = ('loc', 'block', 'block_id', 'block_len', 'literals', 'first', 'org')
+
+        def __init__(self, name, first):
+            self.loc = 0                # offset inside the current program block
+            self.block = 0
+            self.block_id = {name: 0}
+            self.block_len = [0]
+            self.literals = []          # literals waiting for the next LTORG or END
+            self.first = first          # the START or CSECT line
+            self.org = None             # (block, location counter) before the last ORG with an operand
+
+    class LayoutMark:
+        # a Layout between lines and how far the tables had got there, from mark_layout()
+        __slots__ = ('loc', 'block', 'block_id', 'block_len', 'literals', 'first', 'org',
+                     'blocks', 'symbols', 'pooled', 'exports', 'externals')
+
+        def __init__(self, layout, blocks, symbols, pooled, exports, externals):
+            self.loc, self.block, self.first, self.org = layout.loc, layout.block, layout.first, layout.org
+            self.block_id, self.block_len = dict(layout.block_id), list(layout.block_len)
+            self.literals = list(layout.literals)
+            self.blocks = blocks        # number of program block names
+            self.symbols = symbols      # SymbolTable.mark() of the symbols
+            self.pooled = pooled        # and of the literals
+            self.exports = exports
+            self.externals = externals
+
+        def __eq__(self, other):
+            return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    class Expression:
+        # operand expression of numbers, symbols, * (location counter), + - * / and parentheses,
+        # compiled once per text into closures returning (value, relative count)
+        __TOKEN = re.compile('\\s*(?:(\\d+)|([\\w$]+)|([-+*/()]))')
+        __cache = {}
+
+        def __init__(self, text):
+            self.text = text
+            self.symbols = {}           # names in order of appearance
+            self.location = False       # whether * appears
+            self.__tokens = self.__tokenize(text)
+            self.__next = 0
+            self.function = self.__sum()
+            if self.__peek() is not None:
+                raise SyntaxError("invalid expression: {}".format(text))
+            self.symbols = tuple(self.symbols)
+            del self.__tokens
+
+        @classmethod
+        def compile(cls, text):
+            expression = cls.__cache.get(text)
+            if expression is None:
+                if len(cls.__cache) >= 4096:
+                    cls.__cache.clear()
+                expression = cls.__cache[text] = cls(text)
+            return expression
+
+        def evaluate(self, lookup, location=None):
+            # lookup(symbol) -> (value, relative count); the result is absolute when the count is 0
+            if self.location and location is None:
+                raise TypeError("no location counter for {}".format(self.text))
+            return self.function(lookup, location)
+
+        def __tokenize(self, text):
+            tokens = []
+            pos = 0
+            text = text.rstrip()
+            while pos < len(text):
+                match = self.__TOKEN.match(text, pos)
+                if not match:
+                    raise SyntaxError("invalid expression: {}".format(text))
+                number, name, op = match.groups()
+                tokens.append(int(number) if number else ('name', name) if name else op)
+                pos = match.end()
+            return tokens
+
+        def __peek(self):
+            return self.__tokens[self.__next] if self.__next < len(self.__tokens) else None
+
+        def __take(self):
+            token = self.__peek()
+            self.__next += 1
+            return token
+
+        def __sum(self):
+            function = self.__product()
+            while self.__peek() in ('+', '-'):
+                sign = 1 if self.__take() == '+' else -1
+                function = self.__add(function, self.__product(), sign)
+            return function
+
+        def __product(self):
+            function = self.__unary()
+            while self.__peek() in ('*', '/'):
+                op = self.__take()
+                function = self.__multiply(function, self.__unary(), op)
+            return function
+
+        def __unary(self):
+            if self.__peek() == '-':
+                self.__take()
+                return self.__add(lambda lookup, location: (0, 0), self.__unary(), -1)
+            if self.__peek() == '+':
+                self.__take()
+                return self.__unary()
+            return self.__primary()
+
+        def __primary(self):
+            token = self.__take()
+            if type(token) is int:
+                return lambda lookup, location: (token, 0)
+            if type(token) is tuple:
+                name = token[1]
+                self.symbols[name] = None
+                return lambda lookup, location: lookup(name)
+            if token == '*':
+                self.location = True
+                return lambda lookup, location: (location, 1)
+            if token == '(':
+                function = self.__sum()
+                if self.__take() == ')':
+                    return function
+            raise SyntaxError("invalid expression: {}".format(self.text))
+
+        @staticmethod
+        def __add(left, right, sign):
+            def add(lookup, location):
+                a, a_relative = left(lookup, location)
+                b, b_relative = right(lookup, location)
+                return a + sign * b, a_relative + sign * b_relative
+            return add
+
+        def __multiply(self, left, right, op):
+            text = self.text
+
+            def multiply(lookup, location):
+                a, a_relative = left(lookup, location)
+                b, b_relative = right(lookup, location)
+                if a_relative or b_relative:
+                    raise TypeError("relative term in * or / of {}".format(text))
+                if op == '*':
+                    return a * b, 0
+                if not b:
+                    raise ValueError("division by zero in {}".format(text))
+                quotient = abs(a) // abs(b)
+                return (quotient if (a < 0) == (b < 0) else -quotient), 0
+            return multiply
+
+    class Symbol:
+        __slots__ = ('block', 'offset', 'absolute')
+
+        def __init__(self, block, offset, absolute=False):
+            self.block = block          # program block id, None when offset is already an address
+            self.offset = offset
+            self.absolute = absolute
+
+    class SymbolTable(Mapping):
+        # name -> address, computed from the block base table on lookup
+        def __init__(self, bases):
+            self.bases = bases
+            self.entries = {}
+            self.pending = {}           # EQU symbol -> (expression, block, offset) not evaluated yet
+            self.expressions = {}       # every EQU symbol defined by an expression, in order
+            self.dependents = {}        # symbol -> EQU symbols whose expression uses it
+            self.defined = []           # names given to define(), in order
+            self.hidden = None          # (names, EQU symbols) that rewind() left in the table for rewind_rest()
+            self.__hidden_names = None
+            self.__dropped = None
+
+        def taken(self, name):
+            self.reveal(name)
+            return name in self.entries or name in self.pending
+
+        def define(self, name, block, offset, absolute=False):
+            if self.taken(name):
+                raise KeyError("Duplicate symbol {}".format(name))
+            self.entries[name] = Assembler.Symbol(block, offset, absolute)
+            self.defined.append(name)
+
+        def define_expression(self, name, expression, block, offset):
+            # expression is evaluated by resolve(), * stands for the given block offset
+            if self.taken(name):
+                raise KeyError("Duplicate symbol {}".format(name))
+            self.pending[name] = self.expressions[name] = (expression, block, offset)
+            for term in expression.symbols:
+                self.dependents.setdefault(term, []).append(name)
+
+        def mark(self):
+            return len(self.defined), len(self.expressions) - (len(self.hidden[1]) if self.hidden else 0)
+
+        def rewind(self, mark, until=None):
+            # drops what was defined since mark, returns [(name, entry)] and [(name, expression, entry or None)]
+            # of it in order; EQU symbols defined before keep their value until resolve() is told what changed.
+            # With until, a later mark, what was defined after until stays hidden in the table: it is dropped
+            # onto the same lists by rewind_rest() or once a name of it is looked at, and resume() at until
+            # keeps it without going through it
+            self.rewind_rest()
+            defined, expressions = mark
+            stop, last = until or (len(self.defined), len(self.expressions))
+            names, equations = self.defined[defined:stop], list(self.expressions)[expressions:]
+            if stop < len(self.defined) or last < len(self.expressions):
+                self.hidden = self.defined[stop:], equations[last - expressions:]
+            del self.defined[defined:]
+            self.__dropped = (list(zip(names, map(self.entries.pop, names))),
+                              list(map(self.__drop_equation, equations[:last - expressions])))
+            return self.__dropped
+
+        def __drop_equation(self, name):
+            definition = self.expressions.pop(name)
+            self.pending.pop(name, None)
+            for term in definition[0].symbols:
+                dependents = self.dependents[term]
+                dependents.remove(name)
+                if not dependents:
+                    del self.dependents[term]
+            return name, definition, self.entries.pop(name, None)
+
+        def reveal(self, name):
+            # a name about to be looked at must not be one rewind() left hidden
+            if self.hidden is None or name not in self.entries and name not in self.pending:
+                return
+            if self.__hidden_names is None:
+                self.__hidden_names = set(self.hidden[0]).union(self.hidden[1])
+            if name in self.__hidden_names:
+                self.rewind_rest()
+
+        def rewind_rest(self):
+            if self.hidden is None:
+                return
+            (names, equations), dropped = self.hidden, self.__dropped
+            self.hidden = self.__hidden_names = None
+            dropped[0].extend(zip(names, map(self.entries.pop, names)))
+            dropped[1].extend(map(self.__drop_equation, equations))
+
+        def resume(self, dropped, mark, old):
+            # puts back what rewind() dropped after the old mark
+            if self.hidden is not None:
+                if old != (mark[0] + len(dropped[0]), mark[1] + len(dropped[1])):
+                    self.rewind_rest()
+                else:                   # old is the until mark: the hidden rest is kept, after the new lines
+                    names, equations = self.hidden
+                    self.hidden = self.__hidden_names = None
+                    self.defined.extend(names)
+                    if equations:
+                        items = list(self.expressions.items())
+                        start, end = mark[1], mark[1] + len(equations)
+                        self.expressions.clear()
+                        self.expressions.update(items[:start] + items[end:] + items[start:end])
+                    return
+            entries, equations = dropped[0][old[0] - mark[0]:], dropped[1][old[1] - mark[1]:]
+            self.entries.update(entries)
+            self.defined.extend(name for name, entry in entries)
+            for name, definition, entry in equations:
+                self.expressions[name] = definition
+                for term in definition[0].symbols:
+                    self.dependents.setdefault(term, []).append(name)
+                if entry is None:
+                    self.pending[name] = definition
+                else:
+                    self.entries[name] = entry
+
+        def resolve(self, changed=(), previous=None):
+            # evaluate EQU symbols in dependency order, one pass over the pending set; EQU symbols in changed
+            # or depending on a name in it are evaluated again, the address they had goes into previous
+            previous = {} if previous is None else previous
+            seen = set()
+            stack = list(changed)
+            while stack:
+                name = stack.pop()
+                if name in seen:
+                    continue
+                seen.add(name)
+                if name in self.expressions:
+                    entry = self.entries.pop(name, None)
+                    if entry is not None:
+                        previous[name] = self.address(entry)
+                        self.pending[name] = self.expressions[name]
+                stack.extend(self.dependents.get(name, ()))
+            for name in self.pending:
+                previous.setdefault(name, None)
+            missing = {name: len([term for term in expression.symbols if term in self.pending])
+                       for name, (expression, block, offset) in self.pending.items()}
+            ready = [name for name, count in missing.items() if not count]
+            errors = {}                 # a symbol that fails stays pending, and so do the ones using it
+            while ready:
+                name = ready.pop()
+                expression, block, offset = self.pending[name]
+                try:
+                    value, relative = expression.evaluate(self.lookup, self.bases[block] + offset)
+                    if relative not in (0, 1):
+                        raise TypeError("invalid relative expression for {}".format(name))
+                except (TypeError, ValueError) as e:
+                    errors[name] = e
+                    continue
+                del self.pending[name]
+                self.entries[name] = Assembler.Symbol(None, value, absolute=not relative)
+                for dependent in self.dependents.get(name, ()):
+                    if dependent in missing:
+                        missing[dependent] -= 1
+                        if not missing[dependent]:
+                            ready.append(dependent)
+            if self.pending:            # reported in source order, however they were evaluated
+                pending = [name for name in self.expressions if name in self.pending]
+                for name in pending:
+                    if name in errors:
+                        raise errors[name]
+                raise TypeError("undefined symbol: {}".format(", ".join(pending)))
+            return previous
+
+        def lookup(self, name):
+            # (address, relative count) of a symbol for Expression.evaluate
+            entry = self.entries.get(name)
+            if entry is None:
+                raise TypeError("undefined symbol: {}".format(name))
+            return self.address(entry), 0 if entry.absolute else 1
+
+        def address(self, entry):
+            return entry.offset if entry.block is None else self.bases[entry.block] + entry.offset
+
+        def __getitem__(self, name):
+            return self.address(self.entries[name])
+
+        def __contains__(self, name):
+            self.reveal(name)
+            return name in self.entries
+
+        def __iter__(self):
+            return iter(self.entries)
+
+        def __len__(self):
+            return len(self.entries)
+
+    class Line:
+        __slots__ = ('symbol', 'operator', 'operand', 'mnemonic', 'opid', 'format', 'extended',
+                     'ni', 'indexed', 'target', 'operand2', 'literal', 'loc', 'lineno')
+
+        def __init__(self, symbol, operator, operand, lineno=None):
+            self.symbol = symbol
+            self.operator = operator
+            self.operand = operand
+            self.extended = operator[0] == '+'
+            self.mnemonic = operator[1:] if self.extended else operator
+            self.opid = None            # index into the OPTAB, None for directives
+            self.format = 0             # 0 for directives
+            self.ni = 3                 # n=1, i=1
+            self.indexed = False
+            self.target = None          # symbol, literal or number the operand points to
+            self.operand2 = None
+            self.literal = bool(operand) and operand[0] == '='
+            self.loc = None
+            self.lineno = lineno
+
+        def __getitem__(self, key):     # dict-style access for older callers
+            return getattr(self, key)
+
+    class Parser:
+        __SYMBOL = re.compile(r'[\w$]+$')       # $ starts the unique labels of macro expansions
+        __OPERAND = re.compile(r'\S+(\s*\S\s*\S+)?$')
+
+        def __init__(self, optab, directives):
+            self.optab = optab
+            self.version = optab.version
+            self.mnemonics = frozenset(list(optab) + list(directives) + ['+' + i for i in optab])
+            self.regex_calls = 0            # matches made while count_calls() is on
+            self.count_calls(False)
+
+        def count_calls(self, on):
+            # swap in matchers that count their calls, parse() itself does no bookkeeping per line
+            self.symbol_match, self.operand_match = self.__SYMBOL.match, self.__OPERAND.match
+            if on:
+                def counted(match):
+                    def call(text):
+                        self.regex_calls += 1
+                        return match(text)
+                    return call
+                self.symbol_match, self.operand_match = counted(self.symbol_match), counted(self.operand_match)
+
+        def parse(self, line, lineno=None):
+            head = line.split(None, 1)
+            if not head or head[0][0] == '.':       # blank line or comment
+                return None
+            first = head[0]
+            rest = head[1].rstrip() if len(head) > 1 else None
+            if rest:
+                # label form is tried first, the same as the old alternation regex did
+                second = rest.split(None, 1)
+                if second[0] in self.mnemonics:
+                    operand = second[1] if len(second) > 1 else None
+                    if self.symbol_match(first):
+                        if operand is None or self.operand_match(operand):
+                            return self.decode(first, second[0], operand, lineno)
+            if first in self.mnemonics:
+                if rest is None or self.operand_match(rest):
+                    return self.decode(None, first, rest, lineno)
             raise TypeError("invalid operation code")
-        return None
+
+        def decode(self, symbol, operator, operand, lineno=None):
+            line = Assembler.Line(symbol and symbol.upper(), operator.upper(),
+                                  operand and operand.upper(), lineno)
+            opid = self.optab.ids.get(line.mnemonic)
+            if opid is None:
+                return line
+            op_format = self.optab.formats[opid]
+            line.opid = opid
+            line.format = 4 if line.extended and op_format == 3 else op_format
+            operand = line.operand
+            if operand is None:
+                return line
+            if op_format == 2:
+                registers = operand.split(',', 1)
+                line.target = registers[0].strip()
+                line.operand2 = registers[1].strip() if len(registers) > 1 else None
+                return line
+            if operand[0] == '@':
+                line.ni = 2
+                operand = operand[1:]
+            elif operand[0] == '#':
+                line.ni = 1
+                operand = operand[1:]
+            if not line.literal:
+                name, comma, register = operand.rpartition(',')
+                if comma and register.strip() == 'X':
+                    line.indexed = True
+                    operand = name.rstrip()
+            if operand.isdecimal():
+                line.target = int(operand)
+            elif line.literal or self.__SYMBOL.match(operand):
+                line.target = operand
+            else:
+                line.target = Assembler.Expression.compile(operand)
+            return line
 
     class Record:
-        def __init__(self):
-            self.header = ""
-            self.end = ""
-            self.text = []
-            self.modification = []
+        def __init__(self, out=None):
+            self.title = None
             self.start_loc = None
+            self.length = None
+            self.code = bytearray()         # object bytes of text records not written out yet
+            self.segments = []              # [start address, length] of every text record
+            self.modifications = []         # (address, length in half-bytes, '+NAME' / '-NAME' or None)
+            self.definitions = []           # (EXTDEF symbol, address)
+            self.references = []            # EXTREF symbols
+            self.entry = None               # address in the E record, None for a control section after the first
             self.now_loc = None
+            self.out = out
+            self.closed = False
+            self.records = 0                # text records started, including ones already written out
+            self.image = None               # (memory, start address) pass two also writes the code into
+
+        @property
+        def header(self):
+            if self.start_loc is None:
+                return ""
+            header = "H{:<6}{:06X}".format(self.title, self.start_loc)
+            return header if self.length is None else header + "{:06X}".format(self.length)
+
+        @property
+        def end(self):
+            if not self.closed:
+                return ""
+            return "E" if self.entry is None else "E{:06X}".format(self.entry)
+
+        @property
+        def define(self):
+            pairs = ["{:<6}{:06X}".format(name, loc) for name, loc in self.definitions]
+            return ["D" + "".join(pairs[i:i+6]) for i in range(0, len(pairs), 6)]
+
+        @property
+        def refer(self):
+            names = ["{:<6}".format(name) for name in self.references]
+            return ["R" + "".join(names[i:i+12]) for i in range(0, len(names), 12)]
+
+        @property
+        def text(self):
+            return ["T{:06X}{:02X}{}".format(loc, len(code), code.hex().upper()) for loc, code in self.text_segments()]
+
+        @property
+        def modification(self):
+            return ["M{:06X}{:02X}{}".format(loc, length, symbol or "") for loc, length, symbol in self.modifications]
 
-        def add_header(self, title, start_loc):
+        def add_header(self, title, start_loc, length=None):
             if not title:
                 title = "NONE"
+            self.title = title
             self.start_loc = start_loc
-            self.header = "H{:<6}{:06X}".format(title, start_loc)
+            self.entry = start_loc
+            self.length = length
+            if self.out is not None:
+                self.out.write(self.header + '\n')
 
-        def add_end(self, loc):
-            self.end = "E{:06X}".format(self.start_loc)
-            self.header += "{:06X}".format(loc-self.start_loc)
+        def add_definitions(self, definitions):
+            self.definitions.extend(definitions)
+            if self.out is not None:
+                for line in self.define:
+                    self.out.write(line + '\n')
 
-        def add_modification(self, loc, form=4):
+        def add_references(self, names):
+            self.references.extend(names)
+            if self.out is not None:
+                for line in self.refer:
+                    self.out.write(line + '\n')
+
+        def add_end(self, loc=None):
+            if loc is not None:
+                self.length = loc - self.start_loc
+            self.closed = True
+            if self.out is not None:
+                self.flush()
+                for line in self.modification + [self.end]:
+                    self.out.write(line + '\n')
+
+        def add_modification(self, loc, form=4, symbol=None):
+            # form 4 patches the 20 bit address of a format 4 instruction, form 3 a whole word
             if form == 4:
-                self.modification.append("M{:06X}05".format(loc+1))
+                self.modifications.append((loc+1, 5, symbol))
             elif form == 3:
-                self.modification.append("M{:06X}06".format(loc))
+                self.modifications.append((loc, 6, symbol))
+
+        def add_text(self, object_code, loc):
+            size = len(object_code)
+            if not size:
+                return
+            segments = self.segments
+            if not segments or loc != self.now_loc or segments[-1][1] + size > 30:
+                if self.out is not None and segments:
+                    self.flush()
+                segments.append([loc, 0])
+                self.records += 1
+            segments[-1][1] += size
+            self.code += object_code
+            self.now_loc = loc + size
+            if self.image is not None:
+                self.copy_into(*self.image, loc, object_code)
 
-        def add_text(self, opcode, opvalue, loc):
-            opcode = "" if not opcode else opcode
-            opvalue = "" if not opvalue else opvalue
-            object_code = opcode + opvalue
-            if not self.text or not self.text[-1] or loc != self.now_loc or len(self.text[-1]) + len(object_code) > 70:
-                self.now_loc = loc
-                self.text.append("T{:06X}00".format(self.now_loc))
+        @classmethod
+        def loads(cls, text):
+            # rebuild a record from its H/T/M/E text
+            record = cls()
+            for line in text.split('\n'):
+                if line[:1] == 'H':
+                    record.title = line[1:7].rstrip()
+                    record.start_loc = int(line[7:13], 16)
+                    record.length = int(line[13:19], 16)
+                elif line[:1] == 'T':
+                    code = bytes.fromhex(line[9:])
+                    record.segments.append([int(line[1:7], 16), len(code)])
+                    record.code += code
+                elif line[:1] == 'D':
+                    for i in range(1, len(line) - 11, 12):
+                        record.definitions.append((line[i:i+6].rstrip(), int(line[i+6:i+12], 16)))
+                elif line[:1] == 'R':
+                    record.references.extend(line[i:i+6].strip() for i in range(1, len(line), 6) if line[i:i+6].strip())
+                elif line[:1] == 'M':
+                    record.modifications.append((int(line[1:7], 16), int(line[7:9], 16), line[9:].strip() or None))
+                elif line[:1] == 'E':
+                    record.closed = True
+                    record.entry = int(line[1:7], 16) if len(line) > 1 else None
+            return record
 
-            if object_code != "":
-                text_len = int(self.text[-1][7:9], 16) + len(object_code) // 2
-                self.text[-1] = self.text[-1][:7] + "{:02X}".format(text_len) + self.text[-1][9:]
-                self.text[-1] += object_code
-                self.now_loc += len(object_code) // 2
+        def load_into(self, memory, start):
+            # copy the text records into memory, whose first byte is address start
+            for loc, code in self.text_segments():
+                self.copy_into(memory, start, loc, code)
 
-            if not int(self.text[-1][7:9], 16):
-                self.text.pop()
+        @staticmethod
+        def copy_into(memory, start, loc, code):
+            offset = loc - start
+            if offset < 0 or offset + len(code) > len(memory):
+                raise ValueError("code at {:06X} is outside the memory image of {:06X} bytes from {:06X}"
+                                 .format(loc, len(memory), start))
+            memory[offset:offset + len(code)] = code
+
+        def flush(self):
+            # write finished text records to out and drop their bytes
+            for line in self.text:
+                self.out.write(line + '\n')
+            del self.code[:]
+            self.segments.clear()
+
+        def text_segments(self):
+            # (start address, memoryview of its object bytes), no copies of the code buffer
+            code = memoryview(self.code)
+            offset = 0
+            for loc, length in self.segments:
+                yield loc, code[offset:offset+length]
+                offset += length
 
         def __str__(self):
-            string = [self.header] + self.text + self.modification + [self.end]
+            string = [self.header] + self.define + self.refer + self.text + self.modification + [self.end]
             return '\n'.join(string)
 
+    class Listing:
+        # assembly listing written to out while pass two runs, with a cross reference at the end;
+        # only the symbol index is kept, listing lines are written out every buffer_lines lines
+        __UNPLACED = ('BASE', 'END', 'LTORG', 'EXTDEF', 'EXTREF', 'CSECT')
+
+        def __init__(self, out, buffer_lines=256):
+            self.out = out
+            self.buffer = []
+            self.buffer_lines = buffer_lines
+            self.definitions = {}       # symbol -> line number of its definition
+            self.references = {}        # symbol -> array of the line numbers that use it
+
+        def add(self, line, location, code=b'', value=None):
+            # value is shown instead of the location, the EQU value of the symbol
+            if line.mnemonic in self.__UNPLACED:
+                loc = ""
+            else:
+                loc = "{:04X}".format(location if value is None else value)
+            self.__write("{:>5}  {:4}  {:8}{:8}{:18}{}".format(
+                line.lineno or "", loc, line.symbol or "", line.operator, line.operand or "", code.hex().upper()))
+            if line.symbol:
+                self.definitions.setdefault(line.symbol, line.lineno)
+            if line.mnemonic == 'EXTREF':
+                for name in line.operand.split(','):
+                    self.definitions.setdefault(name.strip(), line.lineno)
+            for name in self.__names(line):
+                self.references.setdefault(name, array('I')).append(line.lineno or 0)
+
+        def add_literal(self, literal, location, code):
+            self.__write("{:>5}  {:04X}  {:8}{:8}{:18}{}".format("", location, "*", literal, "", code.hex().upper()))
+
+        def close(self, symbols):
+            # the cross reference: symbol, value, line of its definition and the lines that use it
+            self.__write("")
+            self.__write("{:8}  {:6}  {:>7}  {}".format("Symbol", "Value", "Defined", "References"))
+            for name in sorted(self.definitions):
+                value = "{:04X}".format(symbols[name]) if name in symbols else "EXTREF"
+                lines = " ".join(str(lineno) for lineno in self.references.get(name, ()))
+                self.__write("{:8}  {:6}  {:>7}  {}".format(name, value, self.definitions[name], lines).rstrip())
+            self.flush()
+
+        def flush(self):
+            if self.buffer:
+                self.out.write('\n'.join(self.buffer) + '\n')
+                self.buffer.clear()
+
+        def __write(self, text):
+            self.buffer.append(text.rstrip())
+            if len(self.buffer) >= self.buffer_lines:
+                self.flush()
+
+        @staticmethod
+        def __names(line):
+            # symbols the operand of line uses
+            operator, operand, target = line.mnemonic, line.operand, line.target
+            if operand is None or line.format == 2:
+                return ()
+            if operator in ('WORD', 'EQU', 'ORG'):
+                if operand == '*' or operand.isdecimal():
+                    return ()
+                return Assembler.Expression.compile(operand).symbols
+            if operator in ('EXTDEF', 'BASE', 'END'):
+                return [name.strip() for name in operand.split(',')]
+            if type(target) is str and not line.literal:
+                return (target,)
+            if type(target) is Assembler.Expression:
+                return target.symbols
+            return ()
+
 
 # Helper function (not to be exported)
+def mapped_lines(filename):
+    # lines of a file read through mmap, only lines that are not blank or comments get decoded
+    with open(filename, 'rb') as fin:
+        if not os.fstat(fin.fileno()).st_size:      # an empty file cannot be mapped
+            return
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pos = len(codecs.BOM_UTF8) if data[:3] == codecs.BOM_UTF8 else 0
+            size = len(data)
+            while pos < size:
+                end = data.find(b'\n', pos)
+                if end < 0:
+                    end = size
+                line = data[pos:end]
+                pos = end + 1
+                head = line.lstrip()
+                yield '' if not head or head[:1] == b'.' else line.decode('utf-8')
+
+
+_CONSTANT = re.compile("(?P<type>[CcXx])\\s*'(?P<val>.+)'")
+
+
+@functools.lru_cache(maxsize=4096)
 def constant(value):
-    pattern = re.compile("(?P<type>(C|c|X|x))\s*\'(?P<val>.+)\'")
-    if pattern.match(value):
-        const = pattern.match(value).groupdict()
-    else:
+    # object bytes of a C'...' or X'...' constant, decoded once per literal text
+    match = _CONSTANT.match(value)
+    if not match:
         raise TypeError("invalid format for constant: {}".format(value))
-    result = ""
-    if const['type'].upper() == 'C':
-        for c in const['val']:
-            result += "{:02X}".format(ord(c))
-    else:
-        if len(const['val']) % 2 != 0:
-            raise ValueError("invalid constant value length")
-        else:
-            try:
-                int(const['val'], 16)
-            except ValueError:
-                raise ValueError("invalid constant value with base 16: {}".format(const['val']))
-            result = const['val'].upper()
-    return result
-
-
-def uppercase(line):
-    if line:
-        if line['symbol']:
-            line['symbol'] = line['symbol'].upper()
-        if line['operator']:
-            line['operator'] = line['operator'].upper()
-        if line['operand']:
-            line['operand'] = line['operand'].upper()
-    return line
+    kind, val = match.group('type', 'val')
+    if kind in 'Cc':
+        try:
+            return val.encode('latin-1')
+        except UnicodeEncodeError:
+            raise ValueError("invalid character in constant: {}".format(val))
+    if len(val) % 2 != 0:
+        raise ValueError("invalid constant value length")
+    try:
+        return binascii.unhexlify(val)
+    except binascii.Error:
+        raise ValueError("invalid constant value with base 16: {}".format(val))
 
 
 sys.modules[__name__] = Assembler
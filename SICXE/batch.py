@@ -0,0 +1,140 @@
+import os
+import glob
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from SICXE import Assembler
+from SICXE.cache import Cache
+
+# one warm assembler per worker process, its OPTAB and parser are reused for every file
+_assembler = None
+_cache = None
+
+
+def init_worker(operators=None, cache_dir=None):
+    global _assembler, _cache
+    _assembler = Assembler()
+    if operators:
+        _assembler.load_operators(operators)
+    _cache = Cache(cache_dir) if cache_dir else None
+
+
+def _assemble(filename):
+    if _assembler is None:
+        init_worker()
+    start, cpu = time.perf_counter(), time.process_time()
+    result = {'file': filename, 'object_program': None, 'error': None, 'cached': False}
+    try:
+        sections = _read_sections(filename)
+        if sections is not None:
+            hits = _cache.hits if _cache is not None else 0
+            result['object_program'] = '\n\n'.join(section['object_program'] for section in sections)
+            result['cached'] = _cache is not None and _cache.hits - hits == len(sections)
+        elif _cache is not None:
+            hits = _cache.hits
+            asm = _cache.assemble(_assembler, filename)
+            result['cached'] = _cache.hits > hits
+        else:
+            asm = _assembler.load_file(filename).pass_one().pass_two()
+        if sections is None:
+            result['object_program'] = str(asm.object_program)
+    except Exception as e:
+        result['error'] = "{}: {}".format(type(e).__name__, e)
+    result['time'] = time.perf_counter() - start
+    result['cpu'] = time.process_time() - cpu
+    return result
+
+
+def _read_sections(filename):
+    # the control sections of the file assembled one after another, None for a single program
+    with open(filename, 'r', encoding='utf-8-sig') as fin:
+        if not _assembler.has_sections(fin):
+            return None
+        fin.seek(0)
+        return _assemble_sections(fin.read())
+
+
+def _assemble_sections(text):
+    sections = []
+    for source in _assembler.split_sections(text):
+        if _cache is not None:
+            _cache.assemble_source(_assembler, source)
+        else:
+            _assembler.load_source(source).pass_one().pass_two()
+        sections.append({'object_program': str(_assembler.object_program),
+                         'SYMTAB': dict(_assembler.SYMTAB), 'LITERAL': dict(_assembler.LITERAL)})
+    return sections
+
+
+def handle(request):
+    # one server request {'id', 'path' or 'source'} -> response, in a pool worker set up by init_worker
+    if _assembler is None:
+        init_worker()
+    asm, cache = _assembler, _cache
+    start = time.perf_counter()
+    response = {'id': request.get('id'), 'object_program': None, 'SYMTAB': None, 'LITERAL': None, 'error': None}
+    try:
+        if 'source' in request and asm.has_sections(request['source'].splitlines()):
+            sections = _assemble_sections(request['source'])
+        elif 'path' in request:
+            sections = _read_sections(request['path'])
+        else:
+            sections = None
+        if sections is not None:        # one table per control section, in 'sections'
+            response['object_program'] = '\n\n'.join(section['object_program'] for section in sections)
+            response['sections'] = sections
+        elif 'source' in request:
+            if cache is not None:
+                cache.assemble_source(asm, request['source'])
+            else:
+                asm.load_source(request['source']).pass_one().pass_two()
+        elif 'path' in request:
+            if cache is not None:
+                cache.assemble(asm, request['path'])
+            else:
+                asm.load_file(request['path']).pass_one().pass_two()
+        else:
+            raise KeyError("request needs a 'path' or a 'source'")
+        if sections is None:
+            response['object_program'] = str(asm.object_program)
+            response['SYMTAB'] = dict(asm.SYMTAB)
+            response['LITERAL'] = dict(asm.LITERAL)
+    except Exception as e:
+        response['error'] = "{}: {}".format(type(e).__name__, e)
+    response['time'] = time.perf_counter() - start
+    return response
+
+
+def expand(patterns):
+    files = []
+    for pattern in patterns:
+        if any(c in pattern for c in '*?['):
+            files.extend(sorted(glob.glob(pattern)))
+        else:
+            files.append(pattern)
+    return files
+
+
+def assemble(patterns, operators=None, jobs=None, cache_dir=None):
+    files = expand(patterns)
+    start = time.perf_counter()
+    workers = jobs or os.cpu_count() or 1
+    chunksize = max(1, len(files) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(operators, cache_dir)) as pool:
+        results = list(pool.map(_assemble, files, chunksize=chunksize))     # same order as files
+    summary = {
+        'files': len(results),
+        'failed': sum(1 for i in results if i['error']),
+        'cached': sum(1 for i in results if i['cached']),
+        'wall': time.perf_counter() - start,
+        'cpu': sum(i['cpu'] for i in results),
+        'workers': workers,
+    }
+    return results, summary
+
+
+def report(results, summary, out):
+    for result in results:
+        status = "FAILED  " + result['error'] if result['error'] else "OK (cached)" if result['cached'] else "OK"
+        out.write("{}\t{:.4f}s\t{}\n".format(result['file'], result['time'], status))
+    out.write("{files} files, {failed} failed, {cached} cached, {wall:.3f}s wall, {cpu:.3f}s cpu on {workers} workers\n".format(**summary))
@@ -0,0 +1,129 @@
+import os
+import json
+import hashlib
+
+from SICXE import __version__
+
+
+def default_directory():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'sicxe')
+
+
+class Cache:
+    # assembled results on disk, keyed by source text, OPTAB and assembler version,
+    # bounded by total size and evicted least recently used first
+    def __init__(self, directory=None, max_size=64 * 1024 * 1024):
+        self.directory = directory or default_directory()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.size = None                # bytes in the directory as last counted, plus what put() added since
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(source, optab):
+        digest = hashlib.sha256(__version__.encode())
+        for name, op in optab.items():
+            digest.update("|{}:{}:{}".format(name, op['opcode'], op['format']).encode())
+        digest.update(b'\0')
+        digest.update(source)
+        return digest.hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        path = self.__path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as fin:
+                state = json.load(fin)
+        except (OSError, ValueError):     # missing, half written, or evicted by another process meanwhile
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)      # mark as recently used
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return state
+
+    def put(self, key, state):
+        path = self.__path(key)
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, 'w', encoding='utf-8') as fout:
+            json.dump(state, fout)
+            size = fout.tell()
+        os.replace(tmp, path)
+        if self.size is None:
+            self.evict()
+        else:                   # the directory is scanned again only once the running total is over the limit
+            self.size += size
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        # least recently used entries go until the cache is down to 3/4 of max_size, so that a full
+        # cache is not scanned on every put(); entries other processes remove meanwhile are skipped
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for mtime, size, path in entries)
+        if total > self.max_size:
+            for mtime, size, path in sorted(entries):
+                if total <= self.max_size * 3 // 4:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        self.size = total
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json') or entry.name.endswith('.tmp'):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+        self.size = 0
+
+    def assemble(self, asm, filename, out=None, mapped=False):
+        with open(filename, 'rb') as fin:
+            key = self.key(fin.read(), asm.OPTAB)
+        return self.__assemble(asm, key, out, lambda: asm.load_file(filename, mapped))
+
+    def assemble_source(self, asm, text, out=None):
+        return self.__assemble(asm, self.key(text.encode('utf-8'), asm.OPTAB), out, lambda: asm.load_source(text))
+
+    def __assemble(self, asm, key, out, load):
+        # a hit restores asm without running either pass
+        state = self.get(key)
+        if state is not None:
+            asm.restore(state)
+            if asm.profiler is not None:
+                asm.profiler.count('cache hits')
+            if out is not None:
+                out.write(state['object_program'] + '\n')
+            return asm
+        if out is None:
+            load().pass_one().pass_two()
+            self.put(key, asm.snapshot())
+            return asm
+        records = []            # a streamed program is not kept by its Record, the text is kept on its way out
+
+        class Tee:
+            def write(self, text):
+                records.append(text)
+                return out.write(text)
+        load().pass_one().pass_two(out=Tee())
+        state = asm.snapshot()
+        state['object_program'] = ''.join(records).rstrip('\n')
+        self.put(key, state)
+        return asm
@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import socket
+import argparse
+
+
+class Client:
+    # talks to SICXE.server over its Unix socket; requests may be pipelined and are matched by id
+    def __init__(self, path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.file = self.socket.makefile('rwb')
+        self.next_id = 0
+        self.responses = {}
+
+    def send(self, path=None, source=None):
+        self.next_id += 1
+        request = {'id': self.next_id}
+        if source is not None:
+            request['source'] = source
+        else:
+            request['path'] = os.path.abspath(path)     # the server may run in another directory
+        self.file.write((json.dumps(request) + '\n').encode('utf-8'))
+        self.file.flush()
+        return self.next_id
+
+    def receive(self, request_id):
+        while request_id not in self.responses:
+            line = self.file.readline()
+            if not line:
+                raise ConnectionError("server closed the connection")
+            response = json.loads(line)
+            self.responses[response['id']] = response
+        return self.responses.pop(request_id)
+
+    def assemble(self, path=None, source=None):
+        return self.receive(self.send(path, source))
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="assemble SIC/XE sources on a running SICXE.server")
+    parser.add_argument('file', nargs='+', help="source files, <source>.obj is written next to each")
+    parser.add_argument('-s', '--socket', metavar='PATH', required=True, help="Unix socket of the server")
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help="write the object program of a single source to FILE ('-' for stdout)")
+    args = parser.parse_args(argv)
+    if args.output and len(args.file) > 1:
+        parser.error("--output takes a single source file")
+
+    failed = 0
+    with Client(args.socket) as client:
+        ids = [client.send(path=file) for file in args.file]     # all in flight at once
+        for file, request_id in zip(args.file, ids):
+            response = client.receive(request_id)
+            if response['error']:
+                failed += 1
+                sys.stderr.write("{}: {}\n".format(file, response['error']))
+                continue
+            if args.output == '-':
+                sys.stdout.write(response['object_program'] + '\n')
+                continue
+            with open(args.output or os.path.splitext(file)[0] + '.obj', 'w') as fout:
+                fout.write(response['object_program'] + '\n')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
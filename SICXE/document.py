@@ -0,0 +1,337 @@
+from SICXE import Assembler
+
+ERRORS = (SyntaxError, TypeError, KeyError, ValueError)
+
+
+def _message(e):
+    return "{}: {}".format(type(e).__name__, e)
+
+
+def _names(operand):
+    # symbols of an EXTDEF or EXTREF operand, which is None on a line still being typed
+    return [name.strip() for name in operand.split(',')] if operand is not None else []
+
+
+class Entry:
+    # one source line of a Document and what the analysis found for it
+    __slots__ = ('text', 'line', 'index', 'block', 'base', 'deps',
+                 'parse_error', 'place_error', 'resolve_error', 'check_error')
+
+    def __init__(self, text, line, parse_error):
+        self.text = text
+        self.line = line                # None for comments, blank lines and lines that do not parse
+        self.index = None
+        self.block = None               # None until the line is placed
+        self.base = None                # operand of the last BASE before the line
+        self.deps = ()                  # symbols and literals its code depends on
+        self.parse_error = parse_error
+        self.place_error = None
+        self.resolve_error = None
+        self.check_error = None
+
+    @property
+    def message(self):
+        return self.parse_error or self.place_error or self.resolve_error or self.check_error
+
+
+class Document:
+    # source kept open in an editor: edit() reparses only the lines it replaces, lays the program out again
+    # from the last checkpoint before them and checks only the lines whose code may have changed;
+    # lines are counted from 0 and ranges are [start, end) like list slices
+    def __init__(self, text='', assembler=None, interval=64):
+        self.asm = assembler or Assembler()
+        self.interval = interval        # lines between checkpoints of the layout
+        self.__entries = []
+        self.__checkpoints = []         # (entry, mark, base) taken before the line of entry is placed
+        self.__refs = {}                # symbol or literal -> entries that depend on it
+        self.__unresolved = set()       # entries with a resolve_error
+        self.__first = None             # entry of the line that starts the layout
+        self.__final = None             # mark of the layout after the last line
+        self.__replayed = (0, 0, 0)     # symbols, EQU symbols and literals dropped by the rewind and not put back
+        self.__externals = set()
+        if text:
+            self.edit(0, 0, text)
+
+    @property
+    def text(self):
+        return '\n'.join(entry.text for entry in self.__entries)
+
+    @property
+    def symbols(self):
+        return self.asm.SYMTAB
+
+    @property
+    def literals(self):
+        return self.asm.LITERAL
+
+    @property
+    def diagnostics(self):
+        return {entry.index: entry.message for entry in self.__entries if entry.message}
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def edit(self, start, end, text):
+        # replace lines [start, end) by the lines of text, returns what changed:
+        # {'symbols': {name: (old, new)}, 'literals': {...}, 'diagnostics': {index: (old, new)}}, None when missing
+        entries = self.__entries
+        if not 0 <= start <= end <= len(entries):
+            raise IndexError("lines {}:{} outside the document of {} lines".format(start, end, len(entries)))
+        self.__externals = set()        # names in EXTREF lines removed or placed again
+        for entry in entries[start:end]:
+            self.__unrefer(entry)
+            self.__unresolved.discard(entry)
+            if entry.line is not None and entry.line.mnemonic == 'EXTREF':
+                self.__externals.update(_names(entry.line.operand))
+        added = []
+        for lineno, text_line in enumerate(text.splitlines(), start + 1):
+            try:
+                added.append(Entry(text_line, self.asm.parse_line(text_line, lineno), None))
+            except ERRORS as e:
+                added.append(Entry(text_line, None, _message(e)))
+        before = [checkpoint for checkpoint in self.__checkpoints if checkpoint[0].index < start]
+        after = [checkpoint for checkpoint in self.__checkpoints if checkpoint[0].index >= end]
+        restart = self.__first is None or start <= self.__first.index or not before
+        entries[start:end] = added
+        changes = {entry: None for entry in added}      # entry -> message before the edit
+        if restart:
+            symbols, literals = self.__restart(changes)
+        else:
+            symbols, literals = self.__replay(before, after, changes)
+        diagnostics = {entry.index: (old, entry.message) for entry, old in changes.items()
+                       if entry.message != old}
+        return {'symbols': symbols, 'literals': literals, 'diagnostics': diagnostics}
+
+    def __restart(self, changes):
+        asm, entries = self.asm, self.__entries
+        old_bases = list(asm.SYMTAB.bases)
+        old = dict(asm.SYMTAB), dict(asm.LITERAL)
+        self.__checkpoints = []
+        self.__first = first = next((entry for entry in entries if entry.line is not None), None)
+        try:
+            layout = asm.start_layout(first.line if first else Assembler.Line(None, 'START', '0'))
+        except ERRORS as e:
+            layout = None
+            error = _message(e)
+        if first is None or layout is None:     # nothing is placed, every line is left unchecked
+            self.__unresolved.clear()
+            for index, entry in enumerate(entries):
+                changes.setdefault(entry, entry.message)
+                self.__unrefer(entry)
+                entry.index, entry.block = index, None
+                entry.place_error = entry.resolve_error = entry.check_error = None
+            if first is not None:
+                first.place_error = error
+        else:
+            resume = entries.index(first)
+            for index in range(resume):
+                entries[index].index = index
+            self.__place(resume, layout, None, None, (), changes)
+        return self.__diff(old, (set(asm.SYMTAB), set(asm.LITERAL)), old_bases, changes)
+
+    def __replay(self, before, after, changes):
+        # lays out again from the last checkpoint before the edit, until the layout is back where it was
+        asm = self.asm
+        old_bases = list(asm.SYMTAB.bases)
+        checkpoint = before.pop()
+        self.__checkpoints = before
+        layout, dropped = asm.rewind_layout(checkpoint[1], after[0][1] if after else None)
+        previous = {}                   # EQU symbols evaluated again -> address before
+        defined = self.__place(checkpoint[0].index, layout, checkpoint, dropped, after, changes, previous)
+
+        def address(entry):
+            return entry.offset if entry.block is None else old_bases[entry.block] + entry.offset
+        (symbols, equations), (literals, _) = dropped[:2]
+        symbols, equations, literals = (region[:count] for region, count in
+                                        zip((symbols, equations, literals), self.__replayed))
+        old = previous, {name: address(entry) for name, entry in literals}
+        old[0].update((name, address(entry)) for name, entry in symbols)
+        old[0].update((name, entry and entry.offset) for name, definition, entry in equations)
+        return self.__diff(old, defined, old_bases, changes)
+
+    def __place(self, resume, layout, checkpoint, dropped, after, changes, previous=None):
+        # places the lines from resume on, stopping at the first old checkpoint in after that the layout is
+        # back to; returns the names of the symbols and literals placed
+        asm, entries, checkpoints, interval = self.asm, self.__entries, self.__checkpoints, self.interval
+        table, pooled = asm.SYMTAB, asm.LITERAL
+        symbols, literals = set(), set()
+        balance = {}                    # definition -> times placed now less times placed before
+        consumed = [0, 0, 0]            # old symbols, EQU expressions and literals taken from balance
+
+        def count(key, times):
+            times += balance.get(key, 0)
+            if times:
+                balance[key] = times
+            else:
+                del balance[key]
+
+        def defined(name):
+            entry = table.entries.get(name)
+            if entry is not None:
+                return name, entry.block, entry.offset, entry.absolute
+            expression, block, offset = table.pending[name]
+            return name, expression.text, block, offset
+
+        after = iter(after)
+        target = next(after, None)
+        base = checkpoint[2] if checkpoint else None
+        self.__replayed = (len(dropped[0][0]), len(dropped[0][1]), len(dropped[1][0])) if dropped else (0, 0, 0)
+        for index in range(resume, len(entries)):
+            entry = entries[index]
+            if target is not None and entry is target[0]:
+                mark, old = checkpoint[1], target[1]
+                olds = (dropped[0][0], old.symbols[0] - mark.symbols[0]), \
+                       (dropped[0][1], old.symbols[1] - mark.symbols[1]), \
+                       (dropped[1][0], old.pooled[0] - mark.pooled[0])
+                for i, (items, stop) in enumerate(olds):
+                    for item in items[consumed[i]:stop]:
+                        if i == 1:
+                            name, (expression, block, offset), entry_ = item
+                            count((name, expression.text, block, offset), -1)
+                        else:
+                            name, entry_ = item
+                            count((name, entry_.block, entry_.offset, entry_.absolute), -1)
+                    consumed[i] = max(consumed[i], stop)
+                if not balance and base == target[2] and layout.loc == old.loc and layout.block == old.block \
+                        and asm.mark_layout(layout) == old:
+                    resumed = asm.resume_layout(mark, dropped, old, self.__final)
+                    if resumed is not None:     # the rest is placed as before
+                        self.__replayed = tuple(consumed)
+                        checkpoints.append(target)
+                        checkpoints.extend(after)
+                        if entry.index != index:
+                            for index in range(index, len(entries)):
+                                entries[index].index = index
+                        self.__close(resumed, changes, symbols, dropped, previous)
+                        return symbols, literals
+                asm.rewind_rest()           # the lines after the target are placed again too
+                self.__replayed = (len(dropped[0][0]), len(dropped[0][1]), len(dropped[1][0]))
+                target = next(after, None)
+            entry.index = index
+            if index == resume or not index % interval:
+                checkpoints.append((entry, asm.mark_layout(layout), base))
+            line = entry.line
+            if line is None:
+                continue
+            old = entry.message
+            block, loc, place_error = entry.block, line.loc, entry.place_error
+            line.lineno = index + 1
+            symbol = line.symbol
+            if symbol and table.taken(symbol):
+                symbol = None               # a duplicate defines nothing
+            try:
+                pool = asm.place(line, layout)
+                entry.place_error = None
+            except ERRORS as e:
+                pool = None
+                entry.place_error = _message(e)
+            if symbol and (symbol in table.entries or symbol in table.pending):
+                symbols.add(symbol)
+                count(defined(symbol), 1)
+            for literal in pool or ():
+                literals.add(literal)
+                entry_ = pooled.entries[literal]
+                count((literal, entry_.block, entry_.offset, entry_.absolute), 1)
+            if line.mnemonic == 'BASE':
+                base = line.operand
+            elif line.mnemonic == 'EXTREF':
+                self.__externals.update(_names(line.operand))
+            entry.block = layout.block
+            if block is None or base != entry.base:
+                self.__unrefer(entry)
+                entry.base = base
+                self.__refer(entry)
+                changes.setdefault(entry, old)
+            elif entry.block != block or line.loc != loc or entry.place_error != place_error:
+                changes.setdefault(entry, old)
+        self.__final = asm.mark_layout(layout)
+        self.__close(layout, changes, symbols, dropped, previous)
+        return symbols, literals
+
+    def __close(self, layout, changes, symbols, dropped, previous):
+        # EQU symbols are evaluated again where they depend on a name placed again, or dropped and not put back
+        changed = set(symbols)
+        if dropped is not None:
+            names, equations = dropped[0]
+            changed.update(name for name, entry in names[:self.__replayed[0]])
+            changed.update(item[0] for item in equations[:self.__replayed[1]])
+        for entry in self.__unresolved:
+            changes.setdefault(entry, entry.message)
+            entry.resolve_error = None
+        self.__unresolved.clear()
+        try:
+            self.asm.close_layout(layout, changed, previous)
+        except ERRORS as e:             # EQU symbols left unresolved
+            pending = self.asm.SYMTAB.pending
+            for entry in self.__entries:
+                if entry.line is not None and entry.line.symbol in pending:
+                    changes.setdefault(entry, entry.message)
+                    entry.resolve_error = _message(e)
+                    self.__unresolved.add(entry)
+
+    def __diff(self, old, defined, old_bases, changes):
+        # symbols and literals whose address changed, the entries that depend on them are checked again
+        tables = self.asm.SYMTAB, self.asm.LITERAL
+        bases = tables[0].bases
+        moved = {block for block, base in enumerate(old_bases[:len(bases)]) if bases[block] != base}
+        diffs = []
+        for table, old, names in zip(tables, old, defined):
+            diff = {}
+            for name in names.union(old):
+                address = old.get(name)
+                new = table[name] if name in table else None
+                if new != address:
+                    diff[name] = (address, new)
+            if moved:                   # a block before them changed its length
+                for name, entry in table.entries.items():
+                    if entry.block in moved and name not in old and name not in names:
+                        diff[name] = (old_bases[entry.block] + entry.offset, table.address(entry))
+            diffs.append(diff)
+            for name in diff:
+                for entry in self.__refs.get(name, ()):
+                    changes.setdefault(entry, entry.message)
+        for name in self.__externals:
+            for entry in self.__refs.get(name, ()):
+                changes.setdefault(entry, entry.message)
+        if moved:
+            for entry in self.__entries:
+                if entry.block in moved:
+                    changes.setdefault(entry, entry.message)
+        for entry in changes:
+            line = entry.line
+            if line is None or entry.place_error or entry.block is None:
+                entry.check_error = None
+            else:
+                entry.check_error = self.asm.check(line, entry.block, entry.base)
+        return diffs
+
+    def __refer(self, entry):
+        line = entry.line
+        target = line.target
+        if line.mnemonic == 'WORD' and line.operand is not None:
+            try:
+                deps = list(Assembler.Expression.compile(line.operand).symbols)
+            except ERRORS:
+                deps = []
+        elif line.mnemonic == 'EXTDEF':
+            deps = _names(line.operand)
+        elif type(target) is str and line.format != 2:
+            deps = [target]
+        elif type(target) is Assembler.Expression:
+            deps = list(target.symbols)
+        else:
+            deps = []
+        if line.format == 3 and entry.base:
+            deps.append(entry.base)
+        entry.deps = tuple(deps)
+        for name in deps:
+            self.__refs.setdefault(name, set()).add(entry)
+
+    def __unrefer(self, entry):
+        for name in entry.deps:
+            users = self.__refs.get(name)
+            if users is not None:
+                users.discard(entry)
+                if not users:
+                    del self.__refs[name]
+        entry.deps = ()
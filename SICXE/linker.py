@@ -0,0 +1,152 @@
+import os
+import sys
+import argparse
+
+from SICXE import Assembler
+from SICXE import batch
+from SICXE import server
+from SICXE import objfile
+from SICXE.cache import default_directory
+
+
+def assemble(filenames, jobs=None, operators=None, cache_dir=None):
+    # object program text of every control section in filenames, in order; independent sections are
+    # assembled in parallel, and with a cache a section whose text did not change is not assembled again
+    asm = Assembler()
+    if operators:
+        asm.load_operators(operators)
+    sections = []
+    for filename in filenames:
+        with open(filename, 'r', encoding='utf-8-sig') as fin:
+            sections.extend((filename, text) for text in asm.split_sections(fin.read()))
+    requests = [{'id': i, 'source': text} for i, (filename, text) in enumerate(sections)]
+    workers = min(jobs or os.cpu_count() or 1, len(requests))
+    if workers > 1:
+        with server.make_pool(workers, operators, cache_dir) as pool:
+            responses = list(pool.map(batch.handle, requests))
+    else:
+        batch.init_worker(operators, cache_dir)
+        responses = [batch.handle(request) for request in requests]
+    for (filename, text), response in zip(sections, responses):
+        if response['error']:
+            raise RuntimeError("{}: section {}: {}".format(filename, response['id'] + 1, response['error']))
+    return [response['object_program'] for response in responses]
+
+
+def parse(text):
+    # one Record per H record in the object program text
+    programs = []
+    lines = []
+    for line in text.splitlines():
+        if line[:1] == 'H' and lines:
+            programs.append(Assembler.Record.loads('\n'.join(lines)))
+            lines = []
+        if line.strip():
+            lines.append(line)
+    if lines:
+        programs.append(Assembler.Record.loads('\n'.join(lines)))
+    return programs
+
+
+def link(programs, address=None):
+    # linking loader: pass 1 builds ESTAB from the H and D records of every program, loaded one after
+    # another from address (default the start of the first); pass 2 copies the text and applies modifications
+    if address is None:
+        address = programs[0].start_loc if programs else 0
+    estab = {}
+    deltas = []                 # load address - assembled address, per program
+    csaddr = address
+    for program in programs:
+        delta = csaddr - program.start_loc
+        for name, loc in [(program.title, program.start_loc)] + program.definitions:
+            if name in estab:
+                raise KeyError("Duplicate external symbol {}".format(name))
+            estab[name] = loc + delta
+        deltas.append(delta)
+        csaddr += program.length
+
+    memory = bytearray(csaddr - address)
+    entry = None
+    for program, delta in zip(programs, deltas):
+        program.load_into(memory, address - delta)
+        for loc, length, symbol in program.modifications:
+            if symbol is None:          # relative to the program itself
+                value = delta
+            elif symbol[1:] in estab:
+                value = estab[symbol[1:]] if symbol[0] == '+' else -estab[symbol[1:]]
+            else:
+                raise TypeError("undefined external symbol: {}".format(symbol[1:]))
+            _modify(memory, loc + delta - address, length, value)
+        if entry is None and program.entry is not None:
+            entry = program.entry + delta
+    return memory, estab, entry
+
+
+def _modify(memory, loc, length, value):
+    # add value to the field of length half-bytes that ends at the last byte of the field
+    size = (length + 1) // 2
+    mask = (1 << 4 * length) - 1
+    word = int.from_bytes(memory[loc:loc+size], 'big')
+    memory[loc:loc+size] = (word & ~mask | (word + value) & mask).to_bytes(size, 'big')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="assemble SIC/XE control sections in parallel and link them")
+    parser.add_argument('file', nargs='+', help="source files, or object programs with --objects")
+    parser.add_argument('--objects', action='store_true',
+                        help="the files are object programs, text or binary, only link them")
+    parser.add_argument('-o', '--output', metavar='FILE', help="write the object programs to FILE ('-' for stdout)")
+    parser.add_argument('--image', metavar='FILE', help="write the linked memory image to FILE")
+    parser.add_argument('--address', type=lambda text: int(text, 16), help="load address in hex")
+    parser.add_argument('-j', '--jobs', type=int, help="number of worker processes")
+    parser.add_argument('--operators', metavar='FILE', help="load OPTAB from FILE")
+    parser.add_argument('--cache-dir', metavar='DIR', help="directory of the assembly cache")
+    parser.add_argument('--no-cache', action='store_true', help="bypass the assembly cache")
+    args = parser.parse_args(argv)
+
+    binaries, objects = [], []      # binary objects and texts in command-line order
+    if args.objects:
+        texts = []
+        for filename in args.file:
+            with open(filename, 'rb') as fin:
+                binary = fin.read(len(objfile.MAGIC)) == objfile.MAGIC
+            if binary:              # no text parsing, code is copied straight out of the mapped file
+                binaries.append(objfile.ObjectFile(filename))
+                objects.append(binaries[-1])
+                continue
+            with open(filename, 'r') as fin:
+                texts.append(fin.read())
+            objects.append(texts[-1])
+    else:
+        cache_dir = None if args.no_cache else args.cache_dir or default_directory()
+        texts = assemble(args.file, jobs=args.jobs, operators=args.operators, cache_dir=cache_dir)
+        objects = texts
+    if args.output:
+        fout = sys.stdout if args.output == '-' else open(args.output, 'w')
+        try:
+            for text in texts:
+                fout.write(text.rstrip('\n') + '\n\n')
+        finally:
+            if fout is not sys.stdout:
+                fout.close()
+
+    try:
+        memory, estab, entry = link([program for item in objects for program in
+                                     ([item] if isinstance(item, objfile.ObjectFile) else parse(item))], args.address)
+    finally:
+        for binary in binaries:
+            binary.close()
+    if args.image:
+        with open(args.image, 'wb') as fout:
+            fout.write(memory)
+    if args.output != '-':
+        print("======ESTAB======")
+        for name, loc in estab.items():
+            print(" {:8}\t{:06X}".format(name, loc))
+        if entry is not None:
+            print("entry {:06X}, {} bytes".format(entry, len(memory)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
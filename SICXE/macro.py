@@ -0,0 +1,215 @@
+import re
+from collections import OrderedDict
+
+
+class Macro:
+    # a MACRO ... MEND definition, its body compiled once into templates
+    __PARAMETER = re.compile('&(\\w+)')
+    __CONDITION = re.compile('\\(\\s*(.*?)\\s+(EQ|NE|LT|GT|LE|GE)\\s+(.*?)\\s*\\)$', re.I)
+
+    def __init__(self, name, parameters, body, serial):
+        self.name = name
+        self.serial = serial            # tells a redefinition apart in the expansion cache
+        self.parameters = []            # names in positional order
+        self.defaults = {}
+        for parameter in split_arguments(parameters or ''):
+            name, equal, default = parameter.partition('=')
+            name = name.strip().lstrip('&').upper()
+            self.parameters.append(name)
+            self.defaults[name] = default.strip() if equal else ''
+        self.body = [self.__compile(line) for line in body]
+        self.unique = any('$' in line for line in body)
+
+    def __compile(self, line):
+        fields = line.split(None, 2)
+        operator = fields[0].upper() if fields and line[:1].isspace() else None
+        if operator == 'IF':
+            match = self.__CONDITION.match(fields[1] if len(fields) == 2 else ' '.join(fields[1:]))
+            if not match:
+                raise SyntaxError("invalid macro condition: {}".format(line.strip()))
+            left, relation, right = match.groups()
+            return ('IF', self.__PARAMETER.split(left), relation.upper(), self.__PARAMETER.split(right))
+        if operator in ('ELSE', 'ENDIF'):
+            return (operator,)
+        return ('LINE', self.__PARAMETER.split(line))
+
+    def bind(self, arguments):
+        values = dict(self.defaults)
+        position = 0
+        for argument in split_arguments(arguments or ''):
+            name, equal, value = argument.partition('=')
+            name = name.strip().lstrip('&').upper()
+            if equal and name in values:
+                values[name] = value.strip()
+            elif position < len(self.parameters):
+                values[self.parameters[position]] = argument.strip()
+                position += 1
+            else:
+                raise SyntaxError("too many arguments for macro {}".format(self.name))
+        return tuple(values[name] for name in self.parameters)
+
+    def expand(self, arguments):
+        # body lines with the arguments substituted and IF/ELSE/ENDIF evaluated, $ labels untouched
+        values = dict(zip(self.parameters, arguments))
+
+        def substitute(parts):
+            # parts alternate between text and parameter names, as split by __PARAMETER
+            return ''.join(part if i % 2 == 0 else values.get(part.upper(), '&' + part)
+                           for i, part in enumerate(parts))
+
+        lines = []
+        active = [True]                 # one entry per open IF
+        for template in self.body:
+            kind = template[0]
+            if kind == 'IF':
+                active.append(active[-1] and compare(substitute(template[1]), template[2], substitute(template[3])))
+            elif kind == 'ELSE':
+                if len(active) == 1:
+                    raise SyntaxError("ELSE without IF in macro {}".format(self.name))
+                active[-1] = not active[-1] and all(active[:-1])
+            elif kind == 'ENDIF':
+                if len(active) == 1:
+                    raise SyntaxError("ENDIF without IF in macro {}".format(self.name))
+                active.pop()
+            elif active[-1]:
+                lines.append(substitute(template[1]))
+        if len(active) != 1:
+            raise SyntaxError("IF without ENDIF in macro {}".format(self.name))
+        return lines
+
+
+def compare(left, relation, right):
+    left, right = unquote(left), unquote(right)
+    if left.lstrip('-').isdecimal() and right.lstrip('-').isdecimal():
+        left, right = int(left), int(right)
+    return {
+        'EQ': left == right, 'NE': left != right,
+        'LT': left < right, 'GT': left > right,
+        'LE': left <= right, 'GE': left >= right,
+    }[relation]
+
+
+def unquote(value):
+    value = value.strip()
+    return value[1:-1] if len(value) >= 2 and value[0] == value[-1] == "'" else value
+
+
+def split_arguments(text):
+    # split on commas outside quotes, C'A,B' stays one argument
+    arguments = []
+    start = 0
+    quoted = False
+    for i, c in enumerate(text):
+        if c == "'":
+            quoted = not quoted
+        elif c == ',' and not quoted:
+            arguments.append(text[start:i])
+            start = i + 1
+    if text.strip():
+        arguments.append(text[start:])
+    return arguments
+
+
+class MacroProcessor:
+    # expands MACRO/MEND definitions in a stream of source lines; expansions of the same macro with the
+    # same arguments are kept in a bounded LRU cache, and the definition table has a fixed capacity
+    def __init__(self, max_definitions=1024, cache_size=1024, max_depth=32):
+        self.definitions = {}
+        self.max_definitions = max_definitions
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.max_depth = max_depth
+        self.hits = 0
+        self.misses = 0
+        self.serial = 0
+        self.unique = 0                 # invocations that needed $ labels so far
+
+    def define(self, name, parameters, body):
+        if name not in self.definitions and len(self.definitions) >= self.max_definitions:
+            raise OverflowError("more than {} macro definitions".format(self.max_definitions))
+        self.serial += 1
+        self.definitions[name] = Macro(name, parameters, body, self.serial)
+
+    def expansion(self, macro, arguments):
+        key = (macro.name, macro.serial, arguments)
+        lines = self.cache.get(key)
+        if lines is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return lines
+        self.misses += 1
+        lines = self.cache[key] = macro.expand(arguments)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return lines
+
+    def __prefix(self):
+        # $AA, $AB, ... $ZZ, $BAA, one per invocation with $ labels
+        number = self.unique
+        self.unique += 1
+        letters = ''
+        while number or len(letters) < 2:
+            number, digit = divmod(number, 26)
+            letters = chr(ord('A') + digit) + letters
+        return '$' + letters
+
+    def expand(self, lines, depth=0):
+        # yields source lines with every macro invocation replaced by its expansion
+        lines = iter(lines)
+        for line in lines:
+            line = line.rstrip('\r\n')
+            fields = line.split(None, 2)
+            if not fields or fields[0][0] == '.':
+                yield line
+                continue
+            label = None if line[:1].isspace() else fields[0]
+            rest = fields[1:] if label else fields
+            operator = rest[0].upper() if rest else None
+            operand = rest[1] if len(rest) > 1 else None
+            if operator == 'MACRO':
+                if not label:
+                    raise SyntaxError("MACRO needs a name")
+                self.define(label.upper(), operand, self.__body(lines, label))
+                continue
+            macro = self.definitions.get(operator)
+            if macro is None:
+                yield line
+                continue
+            if depth >= self.max_depth:
+                raise SyntaxError("macro {} nested more than {} levels deep".format(macro.name, self.max_depth))
+            body = self.expansion(macro, macro.bind(operand))
+            if macro.unique:
+                prefix = self.__prefix()
+                body = [i.replace('$', prefix) for i in body]
+            yield '.' + line            # the invocation stays in the source as a comment
+            if label:
+                body = self.__label(label, body)
+            yield from self.expand(body, depth + 1)
+
+    def __body(self, lines, name):
+        body = []
+        depth = 1                       # a definition may hold inner MACRO/MEND pairs
+        for line in lines:
+            line = line.rstrip('\r\n')
+            fields = line.split(None, 2)
+            if not fields or fields[0][0] == '.':
+                continue
+            operator = (fields[0] if line[:1].isspace() else fields[1] if len(fields) > 1 else '').upper()
+            if operator == 'MACRO':
+                depth += 1
+            elif operator == 'MEND':
+                depth -= 1
+                if not depth:
+                    return body
+            body.append(line)
+        raise SyntaxError("MACRO {} without MEND".format(name))
+
+    @staticmethod
+    def __label(label, body):
+        # the invocation label goes on the first generated statement, or on an EQU * before it
+        for i, line in enumerate(body):
+            if line.strip() and line.lstrip()[0] != '.':
+                if line[:1].isspace():
+                    return body[:i] + [label + line] + body[i+1:]
+                break
+        return [label + "    EQU     *"] + body
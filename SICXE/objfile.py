@@ -0,0 +1,155 @@
+import os
+import sys
+import mmap
+import struct
+import argparse
+
+from SICXE import Assembler
+
+# binary object program, little endian:
+#   header, segment table, D entries, R entries, M entries, then the code of every segment back to back
+MAGIC = b'SXOB'
+VERSION = 1
+HAS_ENTRY = 0x1
+HEADER = struct.Struct('<4sHH6sIIIIIII')    # magic, version, flags, title, start, length, entry, counts
+SEGMENT = struct.Struct('<III')             # address, length, offset in the code area
+DEFINITION = struct.Struct('<6sI')          # symbol, address
+REFERENCE = struct.Struct('<6s')
+MODIFICATION = struct.Struct('<IBc6s')      # address, length in half-bytes, b'+' / b'-' / b' ', symbol
+
+
+def _name(name):
+    name = (name or "").encode('ascii')
+    if len(name) > 6:
+        raise ValueError("name {} is longer than 6 characters".format(name.decode()))
+    return name.ljust(6)
+
+
+def dumps(record):
+    if record.out is not None:
+        raise ValueError("object program was streamed, its code is gone")
+    segments = list(record.text_segments())
+    flags = HAS_ENTRY if record.entry is not None else 0
+    parts = [HEADER.pack(MAGIC, VERSION, flags, _name(record.title), record.start_loc, record.length or 0,
+                         record.entry or 0, len(segments), len(record.definitions), len(record.references),
+                         len(record.modifications))]
+    offset = 0
+    for loc, code in segments:
+        parts.append(SEGMENT.pack(loc, len(code), offset))
+        offset += len(code)
+    parts.extend(DEFINITION.pack(_name(name), loc) for name, loc in record.definitions)
+    parts.extend(REFERENCE.pack(_name(name)) for name in record.references)
+    for loc, length, symbol in record.modifications:
+        sign, name = (symbol[:1], symbol[1:]) if symbol else (' ', '')
+        parts.append(MODIFICATION.pack(loc, length, sign.encode('ascii'), _name(name)))
+    parts.extend(code for loc, code in segments)
+    return b''.join(parts)
+
+
+def dump(record, filename):
+    with open(filename, 'wb') as fout:
+        fout.write(dumps(record))
+
+
+def from_text(text):
+    return dumps(Assembler.Record.loads(text))
+
+
+def to_text(data):
+    with ObjectFile(data) as obj:
+        return str(obj.to_record())
+
+
+class ObjectFile:
+    # reads a binary object program from a file through mmap, or from bytes already in memory;
+    # segments() hands out memoryviews into it, they have to be released before close()
+    def __init__(self, source):
+        self.__file = self.__map = None
+        if isinstance(source, (str, os.PathLike)):
+            self.__file = open(source, 'rb')
+            self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+            source = self.__map
+        self.data = data = memoryview(source)
+        try:
+            if len(data) < HEADER.size:
+                raise ValueError("not a SIC/XE binary object")
+            (magic, version, flags, title, self.start_loc, self.length, entry,
+             segments, definitions, references, modifications) = HEADER.unpack_from(data)
+            if magic != MAGIC:
+                raise ValueError("not a SIC/XE binary object")
+            if version != VERSION:
+                raise ValueError("unsupported binary object version {}".format(version))
+            self.title = title.decode('ascii').rstrip()
+            self.entry = entry if flags & HAS_ENTRY else None
+            offset = HEADER.size
+            self.segment_table = list(SEGMENT.iter_unpack(data[offset:offset + segments * SEGMENT.size]))
+            offset += segments * SEGMENT.size
+            self.definitions = [(name.decode('ascii').rstrip(), loc) for name, loc in
+                                DEFINITION.iter_unpack(data[offset:offset + definitions * DEFINITION.size])]
+            offset += definitions * DEFINITION.size
+            self.references = [name.decode('ascii').rstrip() for name, in
+                               REFERENCE.iter_unpack(data[offset:offset + references * REFERENCE.size])]
+            offset += references * REFERENCE.size
+            self.modifications = [(loc, length, None if sign == b' ' else (sign + name.rstrip()).decode('ascii'))
+                                  for loc, length, sign, name in
+                                  MODIFICATION.iter_unpack(data[offset:offset + modifications * MODIFICATION.size])]
+            self.code = offset + modifications * MODIFICATION.size
+        except Exception:       # not an object program, the map and the file are not handed out
+            self.close()
+            raise
+
+    def segments(self):
+        # (start address, memoryview of its bytes), nothing is copied
+        for loc, length, offset in self.segment_table:
+            yield loc, self.data[self.code + offset:self.code + offset + length]
+
+    def load_into(self, memory, start):
+        for loc, code in self.segments():
+            Assembler.Record.copy_into(memory, start, loc, code)
+
+    def to_record(self):
+        record = Assembler.Record()
+        record.title = self.title
+        record.start_loc = self.start_loc
+        record.length = self.length
+        record.entry = self.entry
+        record.definitions = list(self.definitions)
+        record.references = list(self.references)
+        record.modifications = list(self.modifications)
+        for loc, code in self.segments():
+            record.segments.append([loc, len(code)])
+            record.code += code
+        record.closed = True
+        return record
+
+    def close(self):
+        self.data.release()
+        if self.__map is not None:
+            self.__map.close()
+            self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="convert SIC/XE object programs between text records and binary")
+    parser.add_argument('input', help="object program, text or binary")
+    parser.add_argument('output', help="converted object program")
+    args = parser.parse_args(argv)
+    with open(args.input, 'rb') as fin:
+        data = fin.read()
+    if data[:len(MAGIC)] == MAGIC:
+        with open(args.output, 'w') as fout:
+            fout.write(to_text(data) + '\n')
+    else:
+        with open(args.output, 'wb') as fout:
+            fout.write(from_text(data.decode('ascii')))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
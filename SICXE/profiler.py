@@ -0,0 +1,45 @@
+import json
+import time
+from contextlib import contextmanager
+
+
+class Profiler:
+    # wall/CPU timers per assembler phase plus event counters; attach with asm.profiler = Profiler()
+    def __init__(self):
+        self.phases = {}
+        self.counters = {}
+        self.observers = []
+
+    def subscribe(self, callback):
+        # callback(event, name, value) runs after every phase and counter update
+        self.observers.append(callback)
+        return callback
+
+    def notify(self, event, name, value):
+        for callback in self.observers:
+            callback(event, name, value)
+
+    @contextmanager
+    def phase(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield self
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            total = self.phases.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+            total['wall'] += wall
+            total['cpu'] += cpu
+            total['calls'] += 1
+            self.notify('phase', name, {'wall': wall, 'cpu': cpu})
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+        if self.observers:
+            self.notify('count', name, value)
+
+    def report(self):
+        return {'phases': self.phases, 'counters': self.counters}
+
+    def dump(self, out):
+        json.dump(self.report(), out, indent=2)
+        out.write('\n')
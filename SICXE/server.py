@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import argparse
+import threading
+import socketserver
+from concurrent.futures import ProcessPoolExecutor
+
+from SICXE import batch
+from SICXE.cache import default_directory
+
+# JSON lines protocol, one object per line each way:
+#   request  {"id": 1, "path": "prog.asm"} or {"id": 2, "source": "COPY START 0\n..."}
+#   response {"id": 1, "object_program": "H...", "SYMTAB": {...}, "LITERAL": {...}, "error": null, "time": 0.001}
+#   a source of several control sections gets null SYMTAB/LITERAL and a "sections" list of
+#   {"object_program", "SYMTAB", "LITERAL"}, one per section, its object programs joined by a blank line
+# responses come back in the order they finish, matched to requests by id; batch.handle answers them
+
+
+def serve_stream(pool, fin, write):
+    # read requests from the binary stream fin until EOF, write(bytes) is called once per response;
+    # returns once every response has been written, or once writing failed and the rest was dropped
+    lock = threading.Lock()
+    answered = threading.Condition(lock)
+    outstanding = 0             # requests submitted whose response is not written yet
+    closed = False              # a write failed, the other end is gone and nothing more is written
+
+    def reply(response):
+        nonlocal closed
+        data = (json.dumps(response) + '\n').encode('utf-8')
+        with lock:
+            if closed:
+                return
+            try:
+                write(data)
+            except (OSError, ValueError):       # broken pipe, reset connection or closed file
+                closed = True
+
+    def done(future):
+        nonlocal outstanding
+        try:
+            try:
+                response = future.result()
+            except Exception as e:      # the worker itself died
+                response = {'id': future.request_id, 'error': "{}: {}".format(type(e).__name__, e)}
+            reply(response)
+        finally:
+            with lock:
+                outstanding -= 1
+                answered.notify_all()
+
+    for line in fin:
+        if closed:
+            break
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            if type(request) is not dict:
+                raise ValueError("request must be a JSON object")
+        except ValueError as e:
+            reply({'id': None, 'error': "{}: {}".format(type(e).__name__, e)})
+            continue
+        future = pool.submit(batch.handle, request)
+        future.request_id = request.get('id')
+        with lock:
+            outstanding += 1
+        future.add_done_callback(done)          # runs done() here if the future is already finished
+    with lock:
+        answered.wait_for(lambda: not outstanding)
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # one thread per connection, every connection shares the worker pool
+    daemon_threads = True
+
+    def __init__(self, path, pool):
+        self.pool = pool
+        super().__init__(path, Handler)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        def write(data):
+            self.wfile.write(data)
+            self.wfile.flush()
+        serve_stream(self.server.pool, self.rfile, write)
+
+
+def make_pool(jobs=None, operators=None, cache_dir=None):
+    return ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1,
+                               initializer=batch.init_worker, initargs=(operators, cache_dir))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="resident SIC/XE assembler serving JSON lines")
+    parser.add_argument('-s', '--socket', metavar='PATH', help="listen on a Unix socket instead of stdin/stdout")
+    parser.add_argument('-j', '--jobs', type=int, help="number of worker processes")
+    parser.add_argument('--operators', metavar='FILE', help="load OPTAB from FILE in every worker")
+    parser.add_argument('--cache-dir', metavar='DIR', help="directory of the assembly cache")
+    parser.add_argument('--no-cache', action='store_true', help="bypass the assembly cache")
+    args = parser.parse_args(argv)
+
+    cache_dir = None if args.no_cache else args.cache_dir or default_directory()
+    with make_pool(args.jobs, args.operators, cache_dir) as pool:
+        if not args.socket:
+            def write(data):
+                sys.stdout.buffer.write(data)
+                sys.stdout.buffer.flush()
+            serve_stream(pool, sys.stdin.buffer, write)
+            return 0
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        with Server(args.socket, pool) as server:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.remove(args.socket)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+import os
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from SICXE import Assembler
+from SICXE import __version__
+
+FORMAT2 = ["CLEAR   A", "CLEAR   X", "COMPR   A,S", "TIXR    T", "COMPR   X,T"]
+FORMAT3 = ["LDA     V{0}", "STA     V{0}", "LDX     #3", "COMP    #0", "STCH    C{0},X", "TD      C{0}",
+           "JEQ     L{0}", "J       @V{0}", "LDCH    C{0}"]
+FORMAT4 = ["+JSUB   R{1}", "+LDA    V{1}", "+STX    V{1}", "+LDT    #4096"]
+
+
+def generate(lines, mix=(1, 3, 1), literals=True, equ=True, blocks=True, base=True, seed=0):
+    # every chunk is a small routine with its own data, so PC-relative operands always fit;
+    # cross-chunk references go through format 4 and every 16th chunk needs BASE relative addressing
+    rand = random.Random(seed)
+    pools = [FORMAT2, FORMAT3, FORMAT4]
+    source = ["BENCH   START   0"]
+    chunk = 0
+    while len(source) < lines:
+        other = rand.randrange(chunk + 1)
+        source.append("R{0}    CLEAR   X".format(chunk))
+        for i in range(8):
+            pool = rand.choices(pools, weights=mix)[0]
+            source.append("        " + rand.choice(pool).format(chunk, other))
+        if literals:
+            source.append("        LDA     =C'L{}'".format(chunk))
+            source.append("        WD      =X'{:06X}'".format(chunk))
+        far = base and chunk % 16 == 0
+        if far:
+            source.append("        LDB     #F{}".format(chunk))
+            source.append("        BASE    F{}".format(chunk))
+            source.append("        STA     F{}".format(chunk))      # too far for PC, BASE relative
+        if equ:
+            source.append("        +LDT    #E{}".format(chunk))
+        source.append("L{0}    J       S{0}".format(chunk))
+        if literals:
+            source.append("        LTORG")
+        source.append("V{0}    RESW    1".format(chunk))
+        source.append("C{0}    BYTE    X'F1'".format(chunk))
+        if far:
+            source.append("G{0}    RESB    2100".format(chunk))
+            source.append("F{0}    RESW    1".format(chunk))
+        if equ:
+            source.append("E{0}    EQU     V{0}-R{0}".format(chunk))
+        if blocks:
+            source.append("        USE     CBLKS")
+            source.append("B{0}    RESB    64".format(chunk))
+            source.append("        USE")
+        source.append("S{0}    RSUB".format(chunk))
+        chunk += 1
+    source.append("        END     R0")
+    return source
+
+
+def run(filename):
+    asm = Assembler()
+    times = {}
+    start = time.perf_counter()
+    asm.load_file(filename)
+    times['load_file'] = time.perf_counter() - start
+    start = time.perf_counter()
+    asm.pass_one()
+    times['pass_one'] = time.perf_counter() - start
+    start = time.perf_counter()
+    asm.pass_two()
+    times['pass_two'] = time.perf_counter() - start
+    return times
+
+
+def peak_memory(filename):
+    gc.collect()
+    tracemalloc.start()
+    Assembler().load_file(filename).pass_one().pass_two()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def benchmark(lines, repeat=3, **options):
+    source = generate(lines, **options)
+    fd, filename = tempfile.mkstemp(suffix='.asm')
+    try:
+        with os.fdopen(fd, 'w') as fout:
+            fout.write('\n'.join(source) + '\n')
+        runs = [run(filename) for i in range(repeat)]
+        peak = peak_memory(filename)
+    finally:
+        os.remove(filename)
+    phases = {}
+    for phase in ('load_file', 'pass_one', 'pass_two'):
+        best = min(i[phase] for i in runs)
+        phases[phase] = {'seconds': best, 'lines_per_sec': len(source) / best if best else None}
+    total = sum(i['seconds'] for i in phases.values())
+    phases['total'] = {'seconds': total, 'lines_per_sec': len(source) / total if total else None}
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'lines': len(source),
+        'repeat': repeat,
+        'options': {key: list(val) if type(val) is tuple else val for key, val in options.items()},
+        'phases': phases,
+        'peak_memory': peak,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SIC/XE assembler benchmark")
+    parser.add_argument('-n', '--lines', type=int, action='append',
+                        help="size of a synthetic program, repeat for several sizes (default 10000)")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="runs per size, the best time is kept")
+    parser.add_argument('--mix', default="1:3:1", help="weights of format 2:3:4 filler instructions")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-literals', action='store_true')
+    parser.add_argument('--no-equ', action='store_true')
+    parser.add_argument('--no-blocks', action='store_true')
+    parser.add_argument('--no-base', action='store_true')
+    parser.add_argument('--json', metavar='FILE', help="save results to FILE")
+    args = parser.parse_args(argv)
+
+    options = {
+        'mix': tuple(int(i) for i in args.mix.split(':')),
+        'literals': not args.no_literals,
+        'equ': not args.no_equ,
+        'blocks': not args.no_blocks,
+        'base': not args.no_base,
+        'seed': args.seed,
+    }
+    results = []
+    for lines in args.lines or [10000]:
+        result = benchmark(lines, repeat=args.repeat, **options)
+        results.append(result)
+        print("{:>8} lines".format(result['lines']), end='')
+        for phase, val in result['phases'].items():
+            print("  {} {:.4f}s ({:,.0f} lines/s)".format(phase, val['seconds'], val['lines_per_sec'] or 0), end='')
+        print("  peak {:,.0f} KiB".format(result['peak_memory'] / 1024))
+    if args.json:
+        with open(args.json, 'w') as fout:
+            json.dump(results, fout, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
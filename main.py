@@ -1,27 +1,24 @@
+import os
 import sys
+import argparse
 from SICXE import Assembler
+from SICXE import batch
+from SICXE import linker
+from SICXE import objfile
+from SICXE.cache import Cache
+from SICXE.macro import MacroProcessor
+from SICXE.profiler import Profiler
 
-if __name__ == '__main__':
-    try:
-        file = sys.argv[1]
-    except IndexError:
-        file = input("Please input a full file name...>")
-
-    while not file:
-        print("You don't input a file.")
-        file = input("Please input again...>")
 
-    asm = Assembler().load_file(file)
+def print_source(asm):
     print("=====Source code=====")
     for i in asm.source:
-        print("{1}\t{0}\t{2}".format(i['operator'],
-                                     i['symbol'] if i['symbol'] else "\t",
-                                     i['operand'] if i['operand'] else "\t"))
-    print("\n=======OPTAB========\n")
-    for i, val in asm.OPTAB.items():
-        print(" {:6}\t{:2}\t{:02X}".format(i, val['format'], int(val['opcode'], 16)))
+        print("{1}\t{0}\t{2}".format(i.operator,
+                                     i.symbol if i.symbol else "\t",
+                                     i.operand if i.operand else "\t"))
 
-    asm.pass_one()
+
+def print_tables(asm):
     print("\n======SYMTAB======\n")
     print("{:^8}\t{:^5}".format('"symbol"', '"val"'))
     for i, val in asm.SYMTAB.items():
@@ -31,6 +28,146 @@ if __name__ == '__main__':
         for i, val in asm.LITERAL.items():
             print(" {:7}\t{:04X}".format(i, val))
 
-    asm.pass_two()
-    print("\n======Object Program=====\n")
-    print(asm.object_program)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SIC/XE assembler")
+    parser.add_argument('file', nargs='*', help="source file to assemble (files or globs with --batch)")
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help="write the object program to FILE ('-' for stdout) while pass two runs")
+    parser.add_argument('--operators', metavar='FILE', help="load OPTAB from FILE")
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help="assemble every source in a process pool, writing <source>.obj next to each")
+    parser.add_argument('-j', '--jobs', type=int, help="number of worker processes for --batch or control sections")
+    parser.add_argument('--cache-dir', metavar='DIR', help="directory of the assembly cache")
+    parser.add_argument('--no-cache', action='store_true', help="bypass the assembly cache")
+    parser.add_argument('--clear-cache', action='store_true', help="empty the assembly cache first")
+    parser.add_argument('--one-pass', action='store_true',
+                        help="assemble in a single traversal without keeping the source (bypasses the cache)")
+    parser.add_argument('--mmap', action='store_true', help="read the source through a memory map")
+    parser.add_argument('--image', metavar='FILE',
+                        help="write the program's memory image, from its start address, to FILE")
+    parser.add_argument('--binary', metavar='FILE', help="also write the object program in binary form to FILE")
+    parser.add_argument('--relax', action='store_true',
+                        help="turn format 3 instructions that cannot reach their operand into format 4 (bypasses the cache)")
+    parser.add_argument('--macros', action='store_true',
+                        help="expand MACRO/MEND definitions before parsing (bypasses the cache)")
+    parser.add_argument('--listing', metavar='FILE',
+                        help="write the assembly listing and a cross reference to FILE (bypasses the cache)")
+    parser.add_argument('--profile', action='store_true',
+                        help="dump per-phase timings and counters as JSON to stderr")
+    args = parser.parse_args(argv)
+    if args.binary and args.output:
+        parser.error("--binary needs the whole object program, it cannot be used with --output")
+    if args.image and args.output and args.one_pass:
+        parser.error("--image with --one-pass needs the whole object program, it cannot be used with --output")
+    if args.listing and (args.one_pass or args.batch):
+        parser.error("--listing needs pass two, it cannot be used with --one-pass or --batch")
+    if args.relax and (args.one_pass or args.batch):
+        parser.error("--relax needs the whole source in pass one, it cannot be used with --one-pass or --batch")
+    if args.macros and args.batch:
+        parser.error("--macros cannot be used with --batch")
+    if args.batch:
+        unsupported = [option for option, used in (
+            ('--binary', args.binary), ('--image', args.image), ('--mmap', args.mmap),
+            ('--one-pass', args.one_pass), ('--profile', args.profile)) if used]
+        if unsupported:
+            parser.error("{} cannot be used with --batch".format(", ".join(unsupported)))
+
+    if args.clear_cache:
+        Cache(args.cache_dir).clear()
+        if not args.file:
+            return 0
+    cache = None if args.no_cache else Cache(args.cache_dir)
+    if args.batch:
+        return assemble_batch(args, cache)
+    if len(args.file) > 1:
+        parser.error("more than one source file needs --batch")
+    file = args.file[0] if args.file else None
+    if not file:
+        file = input("Please input a full file name...>")
+    while not file:
+        print("You don't input a file.")
+        file = input("Please input again...>")
+
+    asm = Assembler()
+    if args.operators:
+        asm.load_operators(args.operators)
+    sections = False
+    if not args.one_pass:           # a single traversal leaves a CSECT to the assembler to report
+        with open(file, 'r', encoding='utf-8-sig') as fin:
+            sections = asm.has_sections(fin)
+    if sections:                    # control sections are assembled apart, in parallel
+        unsupported = [option for option, used in (
+            ('--mmap', args.mmap), ('--macros', args.macros),
+            ('--relax', args.relax), ('--profile', args.profile), ('--image', args.image),
+            ('--binary', args.binary), ('--listing', args.listing)) if used]
+        if unsupported:
+            parser.error("{} cannot be used with control sections".format(", ".join(unsupported)))
+        programs = linker.assemble([file], jobs=args.jobs, operators=args.operators,
+                                   cache_dir=cache.directory if cache is not None else None)
+        text = '\n\n'.join(program.rstrip('\n') for program in programs) + '\n'
+        if args.output and args.output != '-':
+            with open(args.output, 'w') as fout:
+                fout.write(text)
+        else:
+            print(text, end='')
+        return 0
+
+    if args.profile:
+        asm.profiler = Profiler()
+    macros = MacroProcessor() if args.macros else None
+    fout = flist = None
+    if args.output:
+        fout = sys.stdout if args.output == '-' else open(args.output, 'w')
+    if args.listing:
+        flist = open(args.listing, 'w')
+    try:
+        if args.one_pass:
+            asm.one_pass(file, out=fout, mapped=args.mmap, macros=macros)
+        elif cache is not None and not (args.relax or args.macros or args.listing or args.image):
+            cache.assemble(asm, file, out=fout, mapped=args.mmap)       # a hit skips both passes
+        else:
+            asm.load_file(file, mapped=args.mmap, macros=macros).pass_one(relax=args.relax)
+            asm.pass_two(out=fout, listing=flist, image=args.image)
+    finally:
+        if fout is not None and fout is not sys.stdout:
+            fout.close()
+        if flist is not None:
+            flist.close()
+        if asm.profiler is not None:
+            asm.profiler.dump(sys.stderr)
+    if asm.relaxation:
+        sys.stderr.write("relaxation: {grown} of {candidates} instructions grew to format 4, "
+                         "{saved} bytes saved against extending them all, {rounds} rounds\n".format(**asm.relaxation))
+    if args.image and args.one_pass:
+        asm.image(args.image)
+    if args.binary:
+        objfile.dump(asm.object_program, args.binary)
+    if args.output == '-':      # stdout carries only the object program
+        return 0
+
+    if asm.source:
+        print_source(asm)
+    print("\n=======OPTAB========\n")
+    for i, val in asm.OPTAB.items():
+        print(" {:6}\t{:2}\t{:02X}".format(i, val['format'], int(val['opcode'], 16)))
+    print_tables(asm)
+    if not args.output:
+        print("\n======Object Program=====\n")
+        print(asm.object_program)
+    return 0
+
+
+def assemble_batch(args, cache):
+    cache_dir = cache.directory if cache is not None else None
+    results, summary = batch.assemble(args.file, operators=args.operators, jobs=args.jobs, cache_dir=cache_dir)
+    for result in results:
+        if not result['error']:
+            with open(os.path.splitext(result['file'])[0] + '.obj', 'w') as fout:
+                fout.write(result['object_program'] + '\n')
+    batch.report(results, summary, sys.stdout)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,29 @@
 from SICXE import Assembler
+from SICXE import batch
+from SICXE import server
+from SICXE import linker
+from SICXE import objfile
+from SICXE.client import Client
+from SICXE.macro import MacroProcessor
+from SICXE.cache import Cache
+from SICXE.document import Document
+from SICXE.profiler import Profiler
 import unittest
+import contextlib
+import threading
+import io
+import json
+import tempfile
+import os
+import bench
+
+
+def load_text(text, asm=None):
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "source.asm")
+        with open(filename, 'w') as fout:
+            fout.write(text)
+        return (asm or Assembler()).load_file(filename)
 
 
 class TestAssembler(unittest.TestCase):
@@ -15,6 +39,10 @@ class TestAssembler(unittest.TestCase):
                                          i['symbol'] if i['symbol'] else "\t",
                                          i['operand'] if i['operand'] else "\t"))
 
+    def test_iter_file(self):
+        fields = [(i.symbol, i.operator, i.operand) for i in self.asm.source]
+        self.assertEqual([(i.symbol, i.operator, i.operand) for i in self.asm.iter_file("SICXE.txt")], fields)
+
     def test_load_operators(self):
         load_op = self.asm.load_operators('Operators.dat')
         self.assertIsNotNone(load_op)
@@ -25,6 +53,34 @@ class TestAssembler(unittest.TestCase):
         self.assertIsNotNone(add_op)
         print(add_op)
 
+    def test_parser(self):
+        parser = Assembler.Parser(self.asm.OPTAB, ['START', 'END', 'RESW'])
+        self.assertIsNone(parser.parse("   . comment"))
+        self.assertIsNone(parser.parse("   "))
+        line = parser.parse("first  STL  retadr")
+        self.assertEqual((line.symbol, line.operator, line.operand), ('FIRST', 'STL', 'RETADR'))
+        line = parser.parse("  +JSUB RDREC")
+        self.assertEqual((line.symbol, line.mnemonic, line.format, line.target), (None, 'JSUB', 4, 'RDREC'))
+        line = parser.parse("J @RETADR")
+        self.assertEqual((line.symbol, line.ni, line.target), (None, 2, 'RETADR'))
+        line = parser.parse("  STCH BUFFER,X")
+        self.assertEqual((line.ni, line.indexed, line.target), (3, True, 'BUFFER'))
+        line = parser.parse("  COMP #0")
+        self.assertEqual((line.ni, line.target), (1, 0))
+        line = parser.parse("  COMPR A,S")
+        self.assertEqual((line.format, line.target, line.operand2), (2, 'A', 'S'))
+        self.assertTrue(parser.parse("  LDA =C'EOF'").literal)
+        self.assertRaises(TypeError, parser.parse, "FIRST NOPE RETADR")
+        self.assertRaises(TypeError, parser.parse, "BUF +RESW 1")
+        self.assertRaises(TypeError, parser.parse, "  +END")
+
+    def test_operation_table_view(self):
+        self.assertEqual(self.asm.OPTAB['CLEAR'], {'opcode': '0xb4', 'format': 2})
+        self.asm.append_operator('ADD', '0x18', 3)
+        opid = self.asm.OPTAB.ids['ADD']
+        self.assertEqual((self.asm.OPTAB.opcode(opid), self.asm.OPTAB.format(opid)), (0x18, 3))
+        self.assertIn('ADD', self.asm.OPTAB)
+
     def test_operator_table(self):
         print("=======OPTAB========")
         for i, val in self.asm.OPTAB.items():
@@ -51,5 +107,416 @@ class TestAssembler(unittest.TestCase):
         print("======Object Program=====")
         print(self.asm.object_program)
 
+    def test_record_segments(self):
+        self.asm.pass_one()
+        self.asm.pass_two()
+        program = self.asm.object_program
+        segments = list(program.text_segments())
+        self.assertEqual(len(segments), len(program.text))
+        self.assertEqual(b''.join(code for loc, code in segments), bytes(program.code))
+        for (loc, code), text in zip(segments, program.text):
+            self.assertEqual("T{:06X}{:02X}{}".format(loc, len(code), code.hex().upper()), text)
+            self.assertLessEqual(len(code), 30)
+
+    def test_stream_record(self):
+        out = io.StringIO()
+        self.asm.pass_one()
+        self.asm.pass_two(out=out)
+        expect = Assembler().load_file("SICXE.txt").pass_one().pass_two()
+        self.assertEqual(out.getvalue(), str(expect.object_program) + '\n')
+        self.assertFalse(self.asm.object_program.code)
+
+    def test_batch(self):
+        results, summary = batch.assemble(["SICXE.txt", "SICXE.txt", "missing.txt"], jobs=2)
+        self.asm.pass_one()
+        self.asm.pass_two()
+        self.assertEqual([i['file'] for i in results], ["SICXE.txt", "SICXE.txt", "missing.txt"])
+        self.assertEqual(results[0]['object_program'], str(self.asm.object_program))
+        self.assertIsNone(results[1]['error'])
+        self.assertTrue(results[2]['error'].startswith("FileNotFoundError"))
+        self.assertEqual((summary['files'], summary['failed']), (3, 1))
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = Cache(directory)
+            first = cache.assemble(Assembler(), "SICXE.txt")
+            second = cache.assemble(Assembler(), "SICXE.txt")
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            self.assertEqual(str(second.object_program), str(first.object_program))
+            self.assertEqual(second.SYMTAB, first.SYMTAB)
+            self.assertEqual(second.LITERAL, first.LITERAL)
+            self.assertEqual([line.operator for line in second.source], [line.operator for line in first.source])
+            cache.clear()
+            out = io.StringIO()
+            cache.assemble(Assembler(), "SICXE.txt", out=out)
+            with open("SICXE.txt", 'rb') as fin:
+                self.assertEqual(cache.get(Cache.key(fin.read(), first.OPTAB))['object_program'] + '\n',
+                                 out.getvalue())
+            cache.clear()
+            self.assertIsNone(cache.get(Cache.key(b'', first.OPTAB)))
+
+    def test_bench_program(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "bench.asm")
+            with open(filename, 'w') as fout:
+                fout.write('\n'.join(bench.generate(600)))
+            asm = Assembler().load_file(filename).pass_one().pass_two()
+            self.assertGreaterEqual(len(asm.source), 600)
+            self.assertTrue(asm.object_program.text)
+
+    def test_profiler(self):
+        events = []
+        asm = Assembler()
+        asm.profiler = Profiler()
+        asm.profiler.subscribe(lambda event, name, value: events.append((event, name)))
+        asm.load_file("SICXE.txt").pass_one().pass_two()
+        report = asm.profiler.report()
+        self.assertEqual(set(report['phases']), {'load_file', 'pass_one', 'pass_one.fixup', 'pass_two'})
+        self.assertEqual(report['counters']['lines'], len(asm.source))
+        self.assertEqual(report['counters']['text records'], len(asm.object_program.text))
+        self.assertIn(('phase', 'pass_two'), events)
+
+    def test_symbol_table_blocks(self):
+        asm = load_text("""PROG    START   1000
+        LDA     #LEN
+LEN     EQU     ENDP-BEGIN
+TOTAL   EQU     LEN+4
+        USE     CDATA
+VAL     RESW    1
+        USE
+BEGIN   LDA     VAL
+ENDP    EQU     *
+        END     BEGIN
+""").pass_one().pass_two()
+        self.assertEqual(asm.SYMTAB['BEGIN'], 0x1003)
+        self.assertEqual(asm.SYMTAB['VAL'], 0x1006)       # CDATA follows the default block
+        self.assertEqual((asm.SYMTAB['LEN'], asm.SYMTAB['TOTAL']), (3, 7))
+        self.assertTrue(asm.SYMTAB.entries['TOTAL'].absolute)
+        self.assertFalse(asm.SYMTAB.entries['ENDP'].absolute)
+        self.assertEqual(asm.object_program.text[0], "T00100006010003032000")
+
+    def test_one_pass(self):
+        two_pass = Assembler().load_file("SICXE.txt").pass_one().pass_two()
+        asm = Assembler().one_pass("SICXE.txt")
+        self.assertEqual(str(asm.object_program), str(two_pass.object_program))
+        self.assertEqual(dict(asm.SYMTAB), dict(two_pass.SYMTAB))
+        self.assertEqual(dict(asm.LITERAL), dict(two_pass.LITERAL))
+        self.assertEqual(asm.source, [])
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "bench.asm")
+            with open(filename, 'w') as fout:
+                fout.write('\n'.join(bench.generate(400, seed=1)) + '\n')
+            two_pass = Assembler().load_file(filename).pass_one().pass_two()
+            out = io.StringIO()
+            Assembler().one_pass(filename, out=out)
+        self.assertEqual(out.getvalue(), str(two_pass.object_program) + '\n')
+
+    def test_constants(self):
+        asm = load_text("""DATA    START   0
+        LDA     =C'EOF'
+        LTORG
+TABLE   BYTE    C'ABC'
+        BYTE    X'0aF1'
+        END
+""").pass_one().pass_two()
+        self.assertEqual(asm.LITERAL["=C'EOF'"], 3)
+        self.assertEqual(asm.SYMTAB['TABLE'], 6)
+        self.assertEqual(asm.object_program.text, ["T0000000B032000454F464142430AF1"])
+        with self.assertRaises(ValueError):
+            load_text("X       BYTE    X'F'\n").pass_one()
+        with self.assertRaises(ValueError):
+            load_text("X       BYTE    X'GG'\n").pass_one()
+
+    def test_expressions(self):
+        source = """PROG    START   1000
+FIRST   LDA     BUF+3
+        LDA     #(ENDB-BUF)/3
+        STA     BUF+2*3,X
+        J       *-3
+BUF     RESW    4
+ENDB    EQU     *
+        ORG     BUF+6
+MARK    RESB    1
+        ORG     ENDB
+HALF    EQU     (ENDB-BUF)/2
+NEXT    EQU     *+3
+        USE     CDATA
+TAB     RESW    3
+        USE
+        LDA     TAB+3
+        +LDA    TAB-(3*-1)
+        END     FIRST
+"""
+        asm = load_text(source).pass_one().pass_two()
+        self.assertEqual((asm.SYMTAB['MARK'], asm.SYMTAB['NEXT']), (0x1012, 0x101B))
+        self.assertEqual(asm.SYMTAB['HALF'], 6)
+        self.assertTrue(asm.SYMTAB.entries['HALF'].absolute)
+        self.assertEqual(asm.object_program.text, ["T0010000C03200C0100040FA0093F2FFA", "T0010180703200703101022"])
+        self.assertEqual(asm.object_program.modification, ["M00101C05"])
+        self.assertIs(Assembler.Expression.compile("BUF+3"), Assembler.Expression.compile("BUF+3"))
+        self.assertEqual(Assembler.Expression.compile("(A-B)*2+*").symbols, ("A", "B"))
+        self.assertRaises(SyntaxError, Assembler.Expression.compile, "A+(B")
+        with self.assertRaises(TypeError):
+            load_text("A       RESW    1\nB       EQU     A*2\n").pass_one()
+        asm = load_text(source.replace("ORG     ENDB", "ORG")).pass_one()
+        self.assertEqual(asm.SYMTAB['NEXT'], 0x101B)
+        with self.assertRaises(SyntaxError):
+            load_text("A       RESW    1\n        ORG\n").pass_one()
+        with self.assertRaisesRegex(TypeError, "another program block"):
+            load_text("P       START   0\n        USE     CDATA\nT       RESW    1\n        USE\n        ORG     T\n").pass_one()
+        with self.assertRaisesRegex(SyntaxError, "default program block"):
+            load_text("P       START   1000\n        USE     CDATA\n        ORG     4200\nX       RESW    1\n").pass_one()
+
+    def test_mapped_io(self):
+        asm = Assembler().load_file("SICXE.txt").pass_one().pass_two()
+        mapped = Assembler().load_file("SICXE.txt", mapped=True).pass_one().pass_two()
+        self.assertEqual(str(mapped.object_program), str(asm.object_program))
+        self.assertEqual([i.lineno for i in mapped.source], [i.lineno for i in asm.source])
+        memory = asm.image()
+        self.assertEqual(len(memory), asm.object_program.length)
+        for loc, code in asm.object_program.text_segments():
+            self.assertEqual(memory[loc - asm.object_program.start_loc:][:len(code)], code)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "image.bin")
+            self.assertEqual(asm.image(filename), len(memory))
+            with open(filename, 'rb') as fin:
+                self.assertEqual(fin.read(), memory)
+            Assembler().load_file("SICXE.txt").pass_one().pass_two(out=io.StringIO(), image=filename)
+            with open(filename, 'rb') as fin:
+                self.assertEqual(fin.read(), memory)
+            self.assertRaises(ValueError, asm.object_program.load_into, bytearray(len(memory)),
+                              asm.object_program.start_loc + 1)
+            filename = os.path.join(directory, "empty.asm")
+            open(filename, 'w').close()
+            self.assertEqual(list(Assembler().iter_file(filename, mapped=True)), [])
+
+    def test_server(self):
+        expected = str(Assembler().load_file("SICXE.txt").pass_one().pass_two().object_program)
+        with tempfile.TemporaryDirectory() as directory, server.make_pool(2) as pool:
+            requests = io.BytesIO(b'{"id": 1, "path": "SICXE.txt"}\n[]\n{"id": 2, "source": "A START 0\\n END"}\n')
+            out = io.BytesIO()
+            server.serve_stream(pool, requests, out.write)
+            responses = {i['id']: i for i in map(json.loads, out.getvalue().splitlines())}
+            self.assertEqual(responses[1]['object_program'], expected)
+            self.assertEqual(responses[2]['object_program'], "HA     000000000000\nE000000")
+            self.assertTrue(responses[None]['error'].startswith("ValueError"))
+
+            def broken(data):
+                raise BrokenPipeError()
+            requests.seek(0)
+            server.serve_stream(pool, requests, broken)     # returns although no response could be written
+
+            path = os.path.join(directory, "sicxe.sock")
+            with server.Server(path, pool) as service:
+                threading.Thread(target=service.serve_forever, daemon=True).start()
+                with Client(path) as client:
+                    first, second = client.send(path="SICXE.txt"), client.send(source="X RESB")
+                    self.assertTrue(client.receive(second)["error"])
+                    response = client.receive(first)
+                service.shutdown()
+        self.assertEqual(response['object_program'], expected)
+        self.assertEqual(response['SYMTAB'], dict(Assembler().load_file("SICXE.txt").pass_one().SYMTAB))
+
+    def test_control_sections(self):
+        source = """MAIN    START   0
+        EXTDEF  BUF
+        EXTREF  READ
+FIRST   +JSUB   READ
+        LDA     #LEN
+        J       @RET
+RET     RESW    1
+BUF     RESB    10
+LEN     EQU     *-BUF
+READ    CSECT
+        EXTREF  BUF
+        LDX     #0
+        +STCH   BUF,X
+        RSUB
+SIZE    WORD    BUF+10
+        END     FIRST
+"""
+        sections = Assembler().split_sections(source)
+        self.assertEqual(len(sections), 2)
+        self.assertTrue(sections[1].startswith("READ    CSECT"))
+        self.assertTrue(Assembler().has_sections(source.splitlines()))
+        self.assertFalse(Assembler().has_sections([". CSECT in a comment", "CSECT   START   0", "        END"]))
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "sections.asm")
+            with open(filename, 'w') as fout:
+                fout.write(source)
+            programs = linker.assemble([filename], jobs=2)
+            results, summary = batch.assemble([filename], jobs=1)
+            response = batch.handle({'id': 1, 'source': source})
+            with open(filename, 'w') as fout:
+                fout.write(sections[1])
+            one_pass = Assembler().one_pass(filename)
+        self.assertEqual(programs[0], "\n".join(["HMAIN  000000000017", "DBUF   00000D", "RREAD  ",
+                                                  "T0000000A4B10000001000A3E2000", "M00000105+READ", "E000000"]))
+        self.assertEqual(programs[1], "\n".join(["HREAD  00000000000D", "RBUF   ", "T0000000D050000579000004F000000000A",
+                                                  "M00000405+BUF", "M00000A06+BUF", "E"]))
+        self.assertEqual(str(one_pass.object_program), programs[1])
+        self.assertEqual(results[0]['object_program'], "\n\n".join(programs))
+        self.assertEqual(response['object_program'], "\n\n".join(programs))
+        self.assertEqual([section['object_program'] for section in response['sections']], programs)
+        self.assertIsNone(response['SYMTAB'])
+        self.assertRaises(SyntaxError, load_text(source).pass_one)
+
+        parsed = linker.parse("\n\n".join(programs))
+        self.assertEqual([str(program) for program in parsed], programs)
+        memory, estab, entry = linker.link(parsed, address=0x1000)
+        self.assertEqual(estab, {'MAIN': 0x1000, 'BUF': 0x100D, 'READ': 0x1017})
+        self.assertEqual(entry, 0x1000)
+        self.assertEqual(memory[0:4], bytes.fromhex("4B101017"))
+        self.assertEqual(memory[0x17 + 3:0x17 + 7], bytes.fromhex("5790100D"))
+        self.assertEqual(memory[0x17 + 10:0x17 + 13], (0x100D + 10).to_bytes(3, 'big'))
+        self.assertRaises(TypeError, linker.link, parsed[:1])
+        with tempfile.TemporaryDirectory() as directory:
+            text, binary, image = (os.path.join(directory, name) for name in ("main.obj", "read.sxo", "image.bin"))
+            with open(text, 'w') as fout:
+                fout.write(programs[0])
+            objfile.dump(parsed[1], binary)
+            with contextlib.redirect_stdout(io.StringIO()):
+                linker.main(["--objects", text, binary, "--address", "1000", "--image", image])
+            with open(image, 'rb') as fin:
+                self.assertEqual(fin.read(), bytes(memory))
+            with objfile.ObjectFile(binary) as obj:
+                self.assertRaises(ValueError, obj.load_into, bytearray(obj.length - 1), obj.start_loc)
+
+    def test_binary_object(self):
+        record = Assembler().load_file("SICXE.txt").pass_one().pass_two().object_program
+        data = objfile.dumps(record)
+        self.assertLess(len(data), len(str(record)))
+        self.assertEqual(objfile.to_text(data), str(record))
+        self.assertEqual(objfile.from_text(str(record)), data)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "copy.sxo")
+            objfile.dump(record, filename)
+            with objfile.ObjectFile(filename) as obj:
+                self.assertEqual((obj.title, obj.start_loc, obj.length, obj.entry),
+                                 (record.title, record.start_loc, record.length, record.entry))
+                self.assertEqual([(loc, bytes(code)) for loc, code in obj.segments()],
+                                 [(loc, bytes(code)) for loc, code in record.text_segments()])
+                self.assertEqual(linker.link([obj])[0], linker.link([record])[0])
+            with open(filename, 'r+b') as fout:
+                fout.write(b"XXXX")
+            self.assertRaises(ValueError, objfile.ObjectFile, filename)
+        section = Assembler.Record.loads("HREAD  00000000000D\nRBUF   \nT0000000D050000579000004F000000000A\n"
+                                         "M00000405+BUF\nM00000A06+BUF\nE")
+        self.assertEqual(objfile.to_text(objfile.dumps(section)), str(section))
+        self.assertRaises(ValueError, objfile.ObjectFile, b"HCOPY  000000001077")
+
+    def test_relax(self):
+        source = """PROG    START   0
+FIRST   J       TGT
+        STA     FAR
+        LDA     #BIG
+        LDB     #FAR
+        J       @NEAR
+NEAR    RESW    1
+PAD     RESB    2032
+TGT     RSUB
+GAP     RESB    5000
+FAR     RESW    1
+BIG     EQU     5000
+        END     FIRST
+"""
+        self.assertRaises(SyntaxError, load_text(source).pass_one().pass_two)
+        asm = load_text(source).pass_one(relax=True).pass_two()
+        # the first J only falls out of reach once the three after it have grown
+        self.assertEqual(asm.relaxation, {'candidates': 5, 'grown': 4, 'saved': 1, 'rounds': 2})
+        self.assertEqual(asm.SYMTAB['TGT'], 0x806)
+        self.assertEqual([line.operator for line in asm.source[1:6]], ['+J', '+STA', '+LDA', '+LDB', 'J'])
+        self.assertEqual(asm.object_program.text[0], "T000000133F1008060F101B910110138869101B913E2000")
+        asm = Assembler().load_file("SICXE.txt").pass_one(relax=True).pass_two()
+        self.assertEqual(asm.relaxation['grown'], 0)
+        self.assertEqual(str(asm.object_program), str(Assembler().load_file("SICXE.txt").pass_one().pass_two().object_program))
+
+    def test_macros(self):
+        source = """COPY    START   0
+RDREC   MACRO   &INDEV,&BUFADR,&EOR=04
+        CLEAR   X
+        IF      (&EOR NE '')
+        LDCH    =X'&EOR'
+        ENDIF
+$LOOP   TD      =X'&INDEV'
+        JEQ     $LOOP
+        RD      =X'&INDEV'
+        STCH    &BUFADR,X
+        MEND
+FIRST   RDREC   F1,BUF
+        RDREC   F1,BUF
+        RDREC   BUFADR=BUF,INDEV=F3,EOR=
+BUF     RESB    10
+        END     FIRST
+"""
+        macros = MacroProcessor()
+        lines = [line.split() for line in macros.expand(source.splitlines()) if line[:1] != '.']
+        self.assertEqual(lines[1], ['FIRST', 'CLEAR', 'X'])
+        self.assertEqual(lines[3], ['$AALOOP', 'TD', "=X'F1'"])
+        self.assertEqual(lines[9], ['$ABLOOP', 'TD', "=X'F1'"])
+        self.assertEqual(lines[13:15], [['CLEAR', 'X'], ['$ACLOOP', 'TD', "=X'F3'"]])
+        self.assertEqual((macros.hits, macros.misses), (1, 2))
+        asm = Assembler().load_source(source, macros=MacroProcessor()).pass_one().pass_two()
+        self.assertEqual(asm.SYMTAB['$ABLOOP'], 0x16)
+        self.assertEqual(asm.SYMTAB['BUF'], 0x30)
+        self.assertEqual(dict(asm.LITERAL), {"=X'04'": 0x3A, "=X'F1'": 0x3B, "=X'F3'": 0x3C})
+        self.assertRaises(TypeError, Assembler().load_source, source)
+        self.assertRaises(OverflowError, list, MacroProcessor(max_definitions=0).expand(source.splitlines()))
+        self.assertRaises(SyntaxError, list, MacroProcessor().expand(["        MACRO", "        MEND"]))
+        self.assertRaises(SyntaxError, list, MacroProcessor().expand(["M       MACRO", "        ELSE", "        MEND", "        M"]))
+
+    def test_listing(self):
+        source = """PROG    START   0
+FIRST   LDA     =X'05'
+        J       FIRST
+ALPHA   WORD    FIRST+3
+BETA    EQU     ALPHA
+        END     FIRST"""
+        listing = io.StringIO()
+        asm = Assembler().load_source(source).pass_one()
+        asm.pass_two(listing=listing, out=io.StringIO())
+        lines = listing.getvalue().splitlines()
+        self.assertEqual(lines[1].split(), ['2', '0000', 'FIRST', 'LDA', "=X'05'", '032006'])
+        self.assertEqual(lines[4].split(), ['5', '0006', 'BETA', 'EQU', 'ALPHA'])
+        self.assertEqual(lines[6].split(), ['0009', '*', "=X'05'", '05'])
+        index = lines.index('Symbol    Value   Defined  References')
+        self.assertEqual([line.split() for line in lines[index + 1:]], [
+            ['ALPHA', '0006', '4', '5'], ['BETA', '0006', '5'], ['FIRST', '0000', '2', '3', '4', '6'],
+            ['PROG', '0000', '1']])
+
+    def test_document(self):
+        source = """PROG    START   0
+FIRST   LDA     #3
+        STA     ALPHA
+        J       FIRST
+ALPHA   RESW    1
+BETA    EQU     ALPHA+3
+        END     FIRST"""
+        doc = Document(source, interval=2)
+        self.assertEqual(dict(doc.symbols), {'PROG': 0, 'FIRST': 0, 'ALPHA': 9, 'BETA': 12})
+        self.assertEqual(doc.edit(2, 3, '        STA     BETA'), {'symbols': {}, 'literals': {}, 'diagnostics': {}})
+        changes = doc.edit(2, 2, '        LDB     #0')
+        self.assertEqual(changes['symbols'], {'ALPHA': (9, 12), 'BETA': (12, 15)})
+        changes = doc.edit(4, 5, '        J       GAMMA')
+        self.assertEqual(changes['diagnostics'], {4: (None, 'TypeError: undefined symbol: GAMMA')})
+        changes = doc.edit(6, 6, 'GAMMA   EQU     BETA-FIRST')
+        self.assertEqual(changes['symbols'], {'GAMMA': (None, 15)})
+        self.assertEqual(changes['diagnostics'], {4: ('TypeError: undefined symbol: GAMMA', None)})
+        self.assertEqual(doc.diagnostics, {})
+        for text in ('X       EQU', '        BYTE', '        EXTREF', '        WORD'):
+            changes = doc.edit(7, 7, text)
+            self.assertEqual(changes['diagnostics'], {7: (None, 'SyntaxError: missing operand for ' + text.split()[-1])})
+            doc.edit(7, 8, '')
+        self.assertEqual(doc.diagnostics, {})
+        asm = Assembler().load_source(doc.text).pass_one()
+        self.assertEqual(dict(doc.symbols), dict(asm.SYMTAB))
+        self.assertEqual(doc.edit(1, 2, 'FIRST   LDA     #3'), {'symbols': {}, 'literals': {}, 'diagnostics': {}})
+        doc.edit(2, 3, 'ALPHA   LDB     #0')     # defined again further down, past the next checkpoint
+        fresh = Document(doc.text)
+        self.assertEqual((dict(doc.symbols), doc.diagnostics), (dict(fresh.symbols), fresh.diagnostics))
+        self.assertIsNone(doc.symbols.hidden)
+        self.assertRaises(IndexError, doc.edit, 3, 20, '')
+
+
 if __name__ == "__main__":
     unittest.main()